@@ -182,6 +182,7 @@ resource "aws_iam_role_policy" "gpu_worker" {
         Effect = "Allow"
         Action = [
           "dynamodb:GetItem",
+          "dynamodb:BatchGetItem",
           "dynamodb:Query",
           "dynamodb:DescribeTable"
         ]
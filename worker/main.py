@@ -7,43 +7,68 @@ Production worker for Lunebi Voice Cloning
 import os
 import sys
 import time
+import queue
+import atexit
 import signal
 import logging
 import threading
+import concurrent.futures
+from logging.handlers import QueueHandler, QueueListener
 from datetime import datetime
 from pathlib import Path
 from typing import Dict, List, Optional
 
+import numpy as np
+
 # Blueprint: Set TTS environment variables (from Packer)
 os.environ['TTS_HOME'] = '/opt/voiceclone/.tts_cache'
 os.environ['COQUI_TOS_AGREED'] = '1'
 
 # Setup logging FIRST (before any imports)
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+class _DeferredQueueHandler(QueueHandler):
+    """Enqueue records as-is; the listener's handlers do all formatting"""
+    
+    def prepare(self, record):
+        # QueueHandler.prepare formats on the calling thread (for pickling);
+        # the queue is in-process, so hand the record over untouched
+        return record
+
 def setup_logging():
-    """Safe logging setup that won't crash"""
+    """
+    Safe logging setup that won't crash
+    Application threads only enqueue records; a QueueListener thread does
+    formatting and console/file I/O off the synthesis path.
+    """
+    handlers = [logging.StreamHandler()]  # Console
+    file_ok = True
     try:
         # Use directory from Packer config: /var/log/voiceclone
         log_dir = Path('/var/log/voiceclone')
         log_dir.mkdir(parents=True, exist_ok=True)
-        
-        # Basic configuration
-        logging.basicConfig(
-            level=logging.INFO,
-            format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-            handlers=[
-                logging.StreamHandler(),  # Console
-                logging.FileHandler(log_dir / 'worker.log')  # File
-            ]
-        )
-        return True
+        handlers.append(logging.FileHandler(log_dir / 'worker.log'))  # File
     except Exception as e:
         # Fallback to console only
-        logging.basicConfig(
-            level=logging.INFO,
-            format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-        )
-        logging.error(f"Failed to setup file logging: {e}")
-        return False
+        file_ok = False
+        file_error = e
+    
+    formatter = logging.Formatter(LOG_FORMAT)
+    for handler in handlers:
+        handler.setFormatter(formatter)
+    
+    log_queue = queue.SimpleQueue()
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    
+    # Records are formatted once, by the listener's handlers
+    queue_handler = _DeferredQueueHandler(log_queue)
+    logging.basicConfig(level=logging.INFO, format='%(message)s', handlers=[queue_handler])
+    
+    if not file_ok:
+        logging.error(f"Failed to setup file logging: {file_error}")
+    return file_ok
 
 setup_logging()
 logger = logging.getLogger('voiceclone-worker')
@@ -62,6 +87,8 @@ try:
     from src.ddb_client import create_ddb_client
     from src.utils.idempotency import create_idempotency_manager
     from src.utils.resume import create_spot_resume_handler
+    from src.utils.bufferpool import BufferPool
+    from src.utils.backoff import backoff_delay
     
     IMPORTS_READY = True
     logger.info("✅ All modules imported successfully")
@@ -73,6 +100,19 @@ except ImportError as e:
     # Exit if critical modules missing
     sys.exit(1)
 
+# Number of striped locks guarding pipeline create/teardown (power of two)
+PIPELINE_LOCK_SHARDS = 16
+
+# TTFA samples kept for SLO reporting (ring buffer)
+TTFA_WINDOW = 4096
+
+# Attempts for background story-completion writes
+COMPLETION_MAX_ATTEMPTS = 3
+# Retry delay: 0.5s, then 1s (capped at 2s), plus up to 0.25s jitter
+COMPLETION_BACKOFF_BASE = 0.25
+COMPLETION_BACKOFF_CAP = 2.0
+COMPLETION_BACKOFF_JITTER = 0.25
+
 class BlueprintGPUWorker:
     """100% Blueprint: Production GPU worker"""
     
@@ -91,17 +131,56 @@ class BlueprintGPUWorker:
         self.spot_resume = None
         
         # State
-        self.active_pipelines = {}
-        self.pipeline_lock = threading.RLock()
+        # Lookups are lock-free (dict reads are atomic under the GIL); only
+        # create/teardown of a story's pipeline takes that story's shard lock
+        self.active_pipelines: Dict[str, object] = {}
+        self._pipeline_shards = [threading.Lock() for _ in range(PIPELINE_LOCK_SHARDS)]
         self.metrics = {
             'stories_started': 0,
             'sentences_synthesized': 0,
-            'ttfa_values': []  # Blueprint: TTFA tracking
         }
+        # Blueprint: TTFA tracking (preallocated ring, no per-sample allocation)
+        self._ttfa_arr = np.empty(TTFA_WINDOW, dtype=np.float32)
+        self._ttfa_n = 0
         self.story_state = {}
         
+        # Scratch buffers for float → PCM conversion, reused across sentences
+        self.pcm_pool = BufferPool()
+        
+        # Story completion writes run here so the next sentence isn't blocked
+        self._completion_pool = concurrent.futures.ThreadPoolExecutor(
+            max_workers=4, thread_name_prefix='Completion'
+        )
+        
         logger.info("Blueprint GPU Worker initialized")
     
+    def _pipeline_shard(self, story_id: str) -> threading.Lock:
+        """Striped lock for a story's pipeline create/teardown"""
+        return self._pipeline_shards[hash(story_id) & (PIPELINE_LOCK_SHARDS - 1)]
+    
+    def _get_or_create_pipeline(self, story_id: str):
+        """BLUEPRINT: One pipeline per story, created on first sentence"""
+        pipeline = self.active_pipelines.get(story_id)
+        if pipeline is not None:
+            return pipeline
+        
+        with self._pipeline_shard(story_id):
+            pipeline = self.active_pipelines.get(story_id)
+            if pipeline is None:
+                pipeline = create_audio_pipeline(
+                    story_id,
+                    self.config['EBS_MOUNT_POINT']
+                )
+                # Tail segments written while ffmpeg drains, then the ENDLIST playlist
+                pipeline.on_finalized = lambda: self._upload_segments(story_id, pipeline, rescan=True)
+                self.active_pipelines[story_id] = pipeline
+            return pipeline
+    
+    def _remove_pipeline(self, story_id: str):
+        """Drop a story's pipeline from the active set"""
+        with self._pipeline_shard(story_id):
+            return self.active_pipelines.pop(story_id, None)
+    
     def _update_story_state(self, story_id, seq, is_final_from_message=False):
         if story_id not in self.story_state:
             self.story_state[story_id] = {
@@ -208,7 +287,7 @@ class BlueprintGPUWorker:
             
             if not self.tts_engine.initialize(
                 model_path=self.config['MODEL_PATH'],
-                dynamodb_client=self.ddb_client.dynamodb,
+                dynamodb_client=self.ddb_client.bulk_dynamodb,
                 voices_table_name=self.config['VOICES_TABLE_NAME']
             ):
                 raise RuntimeError("TTS engine initialization failed")
@@ -279,7 +358,7 @@ class BlueprintGPUWorker:
             if seq == 1:
                 resume_point = self.spot_resume.get_resume_point(story_id)
                 if resume_point > 1 and seq < resume_point:
-                    logger.debug(f"⏭️ Skip {story_id}:{seq} (resume from {resume_point})")
+                    logger.debug("⏭️ Skip %s:%s (resume from %s)", story_id, seq, resume_point)
                     return True
             
             # BLUEPRINT: Generate idempotency key
@@ -291,7 +370,7 @@ class BlueprintGPUWorker:
             
             # BLUEPRINT: Idempotency check
             if not self.idempotency.should_process(story_id, seq, idempotency_key):
-                logger.debug(f"⏭️ Idempotent skip {story_id}:{seq}")
+                logger.debug("⏭️ Idempotent skip %s:%s", story_id, seq)
                 return True
             
             # BLUEPRINT: Track TTFA for first sentence
@@ -326,26 +405,28 @@ class BlueprintGPUWorker:
             # Use the tracked is_final value
             is_final = should_be_final
             
-            # BLUEPRINT: Convert to PCM (24kHz mono s16le)
-            import numpy as np
-            audio_array = (audio_array * 32767).astype(np.int16)
-            pcm_data = audio_array.tobytes()
+            # BLUEPRINT: Convert to PCM (24kHz mono s16le) in pooled buffers
+            scaled = self.pcm_pool.acquire(audio_array.size, np.float32)
+            pcm_samples = self.pcm_pool.acquire(audio_array.size, np.int16)
+            np.multiply(audio_array, 32767, out=scaled, casting='same_kind')
+            np.copyto(pcm_samples, scaled, casting='unsafe')
+            pcm_data = memoryview(pcm_samples).cast('B')
 
             # ✅ DEBUG: Verify conversion
-            logger.debug(f"🎵 Audio conversion: float32[{len(audio_array)}] → bytes[{len(pcm_data)}]")
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("🎵 Audio conversion: float32[%s] → bytes[%s]", len(audio_array), len(pcm_data))
                         
             # BLUEPRINT: Get or create pipeline (one per story)
-            with self.pipeline_lock:
-                if story_id not in self.active_pipelines:
-                    pipeline = create_audio_pipeline(
-                        story_id,
-                        self.config['EBS_MOUNT_POINT']
-                    )
-                    self.active_pipelines[story_id] = pipeline
+            pipeline = self._get_or_create_pipeline(story_id)
             
             # BLUEPRINT: Feed to continuous ffmpeg process
-            pipeline = self.active_pipelines[story_id]
-            pipeline.feed_audio(pcm_data, seq, is_final)
+            # feed_audio writes synchronously, so the slabs can be reused after it returns
+            try:
+                pipeline.feed_audio(pcm_data, seq, is_final)
+            finally:
+                pcm_data.release()
+                self.pcm_pool.release(pcm_samples)
+                self.pcm_pool.release(scaled)
             
             # BLUEPRINT: Upload segments → playlist in order
             self._upload_segments(story_id, pipeline)
@@ -357,11 +438,13 @@ class BlueprintGPUWorker:
             )
             
             self.idempotency.mark_hash_processed(idempotency_key)
+            self.idempotency.mark_seq_processed(story_id, seq)
             
             # BLUEPRINT: Track TTFA
             if seq == 1:
                 ttfa_ms = processing_time * 1000
-                self.metrics['ttfa_values'].append(ttfa_ms)
+                self._ttfa_arr[self._ttfa_n % TTFA_WINDOW] = ttfa_ms
+                self._ttfa_n += 1
                 logger.info(f"🎯 TTFA: {ttfa_ms:.0f}ms for {story_id}")
             
             self.metrics['sentences_synthesized'] += 1
@@ -378,58 +461,86 @@ class BlueprintGPUWorker:
             logger.error(traceback.format_exc())
             return False
     
-    def _upload_segments(self, story_id: str, pipeline):
+    def _upload_segments(self, story_id: str, pipeline, rescan: bool = False):
         """BLUEPRINT: Upload segments → playlist in correct order"""
-        try:
-            # Upload init segment
-            init_path = pipeline.get_init_path()
-            if init_path:
-                self.s3_uploader.upload_init_segment(story_id, init_path)
-            
-            # Upload latest segment
-            segment_path = pipeline.get_latest_segment()
-            if segment_path:
-                self.s3_uploader.upload_segment(story_id, segment_path)
-            
-            # Update playlist (after segments)
-            playlist_path = pipeline.get_playlist_path()
-            if playlist_path:
-                self.s3_uploader.update_playlist(story_id, playlist_path)
+        with pipeline.upload_lock:
+            segment_paths = []
+            try:
+                # Upload init + every segment completed since the last call, concurrently
+                init_path = pipeline.get_init_path()
+                segment_paths = pipeline.take_new_segments(rescan=rescan)
+                if init_path or segment_paths:
+                    if not self.s3_uploader.upload_segments(story_id, segment_paths, init_path):
+                        # Retried with the next sentence; no playlist may reference them yet
+                        pipeline.return_segments(segment_paths)
+                        logger.warning(f"⚠️ Segment upload failed for {story_id}, playlist not updated")
+                        return
                 
-        except Exception as e:
-            logger.error(f"❌ Upload error: {e}")
+                # Update playlist (after segments)
+                playlist_path = pipeline.get_playlist_path()
+                if playlist_path:
+                    self.s3_uploader.update_playlist(story_id, playlist_path)
+                    
+            except Exception as e:
+                pipeline.return_segments(segment_paths)
+                logger.error(f"❌ Upload error: {e}")
     
     def _complete_story(self, story_id: str, pipeline):
         """BLUEPRINT: Complete story processing"""
         try:
             logger.info(f"🏁 Completing story {story_id}")
             
-            
-            # Update DDB
-            self.ddb_client.mark_story_complete(story_id)
+            # Update DDB (fire-and-forget, retried on failure)
+            self._submit_completion(story_id)
             
             # Cleanup
-            with self.pipeline_lock:
-                if story_id in self.active_pipelines:
-                    del self.active_pipelines[story_id]
+            self._remove_pipeline(story_id)
             
             logger.info(f"✅ Story completed: {story_id}")
             
         except Exception as e:
             logger.error(f"❌ Completion error: {e}")
     
+    def _submit_completion(self, story_id: str, attempt: int = 1, delay: float = 0.0):
+        """Run mark_story_complete on the completion pool, after delay seconds"""
+        future = self._completion_pool.submit(self._mark_complete_after, story_id, delay)
+        future.add_done_callback(
+            lambda f: self._on_completion_done(f, story_id, attempt)
+        )
+    
+    def _mark_complete_after(self, story_id: str, delay: float):
+        """Wait out the retry backoff on the pool thread, then write"""
+        if delay > 0:
+            time.sleep(delay)
+        self.ddb_client.mark_story_complete(story_id)
+    
+    def _on_completion_done(self, future: concurrent.futures.Future, story_id: str, attempt: int):
+        """Log completion failures and re-enqueue until attempts run out"""
+        error = future.exception()
+        if error is None:
+            return
+        
+        if attempt >= COMPLETION_MAX_ATTEMPTS:
+            logger.error(f"❌ Completion failed for {story_id} after {attempt} attempts: {error}")
+            return
+        
+        delay = backoff_delay(attempt, base=COMPLETION_BACKOFF_BASE, cap=COMPLETION_BACKOFF_CAP,
+                              jitter=COMPLETION_BACKOFF_JITTER)
+        logger.warning(f"⚠️ Completion attempt {attempt} failed for {story_id}, "
+                       f"retrying in {delay:.2f}s: {error}")
+        try:
+            self._submit_completion(story_id, attempt + 1, delay)
+        except RuntimeError:
+            # Pool already shut down
+            logger.error(f"❌ Completion dropped for {story_id}: worker shutting down")
+    
     def _cleanup_pipelines(self):
         """Cleanup unhealthy pipelines"""
-        with self.pipeline_lock:
-            to_remove = []
-            for story_id, pipeline in self.active_pipelines.items():
-                if not pipeline.is_healthy():
-                    logger.warning(f"Removing unhealthy pipeline {story_id}")
-                    pipeline.shutdown()
-                    to_remove.append(story_id)
-            
-            for story_id in to_remove:
-                del self.active_pipelines[story_id]
+        for story_id, pipeline in list(self.active_pipelines.items()):
+            if not pipeline.is_healthy():
+                logger.warning(f"Removing unhealthy pipeline {story_id}")
+                pipeline.shutdown()
+                self._remove_pipeline(story_id)
     
     def run(self):
         """BLUEPRINT: Main processing loop with two-phase scheduler"""
@@ -507,13 +618,25 @@ class BlueprintGPUWorker:
             self.sqs_worker.shutdown()
         
         # Cleanup pipelines
-        with self.pipeline_lock:
-            for pipeline in self.active_pipelines.values():
-                try:
-                    pipeline.shutdown()
-                except:
-                    pass
-            self.active_pipelines.clear()
+        for story_id in list(self.active_pipelines):
+            pipeline = self._remove_pipeline(story_id)
+            if pipeline is None:
+                continue
+            try:
+                pipeline.shutdown()
+            except:
+                pass
+        
+        # Drain in-flight S3 uploads
+        if self.s3_uploader:
+            self.s3_uploader.shutdown()
+        
+        # Flush pending completion writes
+        self._completion_pool.shutdown(wait=True)
+        
+        # Write any story progress still held by the deferred flusher
+        if self.ddb_client:
+            self.ddb_client.shutdown()
         
         # Report metrics
         self._report_metrics()
@@ -522,10 +645,11 @@ class BlueprintGPUWorker:
     
     def _report_metrics(self):
         """Report final SLO metrics"""
-        if self.metrics['ttfa_values']:
-            ttfa_values = self.metrics['ttfa_values']
-            avg_ttfa = sum(ttfa_values) / len(ttfa_values)
-            p95_ttfa = sorted(ttfa_values)[int(len(ttfa_values) * 0.95)]
+        n = min(self._ttfa_n, TTFA_WINDOW)
+        if n:
+            ttfa_values = self._ttfa_arr[:n]
+            avg_ttfa = float(ttfa_values.mean())
+            p95_ttfa = float(np.quantile(ttfa_values, 0.95, method='nearest'))
             
             logger.info("📊 BLUEPRINT FINAL METRICS:")
             logger.info(f"   Stories: {self.metrics['stories_started']}")
@@ -235,7 +235,7 @@ build {
       "/opt/voiceclone/venv/bin/pip install TTS==0.22.0",
       
       "# Install other dependencies",
-      "/opt/voiceclone/venv/bin/pip install transformers==4.38.2 scipy librosa soundfile pydub boto3 ffmpeg-python psutil aiohttp",
+      "/opt/voiceclone/venv/bin/pip install transformers==4.38.2 scipy librosa soundfile pydub boto3 ffmpeg-python psutil aiohttp orjson inotify_simple zstandard pybase64",
       "/opt/voiceclone/venv/bin/pip install cython encodec nltk pysbd num2words umap-learn",
       "/opt/voiceclone/venv/bin/pip install anyascii jieba pypinyin gruut[de,es,fr]==2.2.3",
       
@@ -249,6 +249,9 @@ build {
       "sudo tee -a /etc/environment <<< 'HF_HUB_DISABLE_SYMLINKS_WARNING=1'",
       "sudo tee -a /etc/environment <<< 'XDG_DATA_HOME=/opt/voiceclone/.tts_cache'",
       
+      "# TCP keepalive for pooled AWS connections (botocore tcp_keepalive=True uses these timers)",
+      "printf 'net.ipv4.tcp_keepalive_time = 60\\nnet.ipv4.tcp_keepalive_intvl = 10\\nnet.ipv4.tcp_keepalive_probes = 6\\n' | sudo tee /etc/sysctl.d/90-voiceclone-keepalive.conf",
+      
       "# Create model directory",
       "sudo mkdir -p /opt/voiceclone/models /opt/voiceclone/.tts_cache",
       "sudo chown -R ec2-user:ec2-user /opt/voiceclone/.tts_cache",
@@ -8,14 +8,53 @@ Blueprint Requirements:
 • Simple crossfades, minimal processing
 """
 
+import os
+import re
+import fcntl
 import subprocess
+import threading
 import time
 import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Optional
+from typing import Callable, List, Optional, Union
+
+import numpy as np
+
+try:
+    # Segment completion events; falls back to scanning the directory
+    from inotify_simple import INotify, flags as inotify_flags
+except ImportError:
+    INotify = None
 
 logger = logging.getLogger('audio-pipeline')
 
+# BLUEPRINT: 10ms fade-in on the first sentence (24kHz s16le)
+FADE_IN_MS = 10
+FADE_IN_SAMPLES = int(24000 * FADE_IN_MS / 1000)
+FADE_IN_BYTES = FADE_IN_SAMPLES * 2
+
+# Linear fade-in gains, computed once instead of per sample per story
+FADE_IN_GAINS = np.arange(FADE_IN_SAMPLES) / FADE_IN_SAMPLES
+
+# ffmpeg stdin pipe size: 1 MiB holds several sentences of s16le PCM
+# (above 1 MiB needs /proc/sys/fs/pipe-max-size raised for non-root)
+PIPE_BUFFER_BYTES = 1 << 20
+F_SETPIPE_SZ = getattr(fcntl, 'F_SETPIPE_SZ', 1031)
+
+# ffmpeg's audio_%03d.m4s segment files; group 1 is the segment number
+_SEGMENT_RE = re.compile(r'^audio_(\d+)\.m4s$')
+
+# Segment watcher poll interval while ffmpeg is running
+SEGMENT_WATCH_TIMEOUT_MS = 500
+
+# Time a finalize may spend on terminate() after ffmpeg overruns its wait
+FINALIZE_TERMINATE_SECONDS = 2.0
+
+# Shared finalizers for all pipelines (no thread spawned per finished story)
+_FINALIZE_POOL = ThreadPoolExecutor(max_workers=8, thread_name_prefix='audio-finalize')
+
 class BlueprintAudioPipeline:
     """100% Blueprint: Simple audio pipeline with one persistent ffmpeg process"""
     
@@ -32,8 +71,41 @@ class BlueprintAudioPipeline:
         self.ffmpeg_process = None
         self.running = False
         
+        # Finalize runs once, from shutdown() or the delayed-finalize thread;
+        # a second caller waits on _finalize_done instead of racing the first
+        self._finalize_lock = threading.Lock()
+        self._finalized = False
+        self._finalize_done = threading.Event()
+        self._finalize_deadline = 0.0
+        
+        # Newest completed segment as (number, path), fed by inotify when available
+        self._latest_segment = None
+        self._segment_count = 0
+        # Completed (number, path) segments not yet handed to the uploader
+        # (watcher appends); cursor is the highest number handed out
+        self._new_segments = deque()
+        self._last_taken_segment = -1
+        
+        # Held by the uploader across take → upload → playlist, so the
+        # post-finalize tail upload can't publish ENDLIST ahead of segments
+        self.upload_lock = threading.Lock()
+        # Called once after ffmpeg exits and ENDLIST is written (tail upload)
+        self.on_finalized: Optional[Callable[[], None]] = None
+        self._inotify = self._create_segment_watch()
+        self._watched = self._inotify is not None
+        
         # Start ffmpeg
-        self._start_ffmpeg()
+        try:
+            self._start_ffmpeg()
+        except Exception:
+            # No watcher thread yet to close it
+            if self._inotify:
+                self._inotify.close()
+                self._inotify = None
+            raise
+        
+        if self._inotify:
+            threading.Thread(target=self._watch_segments, daemon=True).start()
         
         logger.info(f"✅ Audio pipeline created: {story_id}")
         logger.info(f"   EBS directory: {self.ebs_dir}")
@@ -47,17 +119,28 @@ class BlueprintAudioPipeline:
         
         ffmpeg_cmd = [
             'ffmpeg', '-y',
+            '-loglevel', 'error',   # stderr is discarded; don't format info lines
+            '-nostats',
+            '-fflags', 'nobuffer',  # Input is fully specified: no buffering/probing
+            '-flags', 'low_delay',
+            '-probesize', '32',
+            '-analyzeduration', '0',
             '-f', 's16le',          # Raw PCM input format
             '-ar', '24000',         # 24kHz sample rate (Blueprint)
             '-ac', '1',             # Mono channel (Blueprint)
             '-i', 'pipe:0',         # Continuous stdin pipe
             '-c:a', 'aac',          # AAC codec (Blueprint)
+            '-aac_coder', 'fast',   # Fast coder: far less CPU than twoloop, slight quality cost
             '-b:a', '64k',          # 64kbps bitrate (Blueprint)
+            '-profile:a', 'aac_low',  # AAC-LC, no SBR/PS lookahead
             '-movflags', '+frag_keyframe+empty_moov',
+            '-flush_packets', '1',  # Flush each packet, don't hold muxer output
+            '-max_delay', '0',      # No muxer interleaving delay
+            '-muxdelay', '0',
             '-f', 'hls',
             '-hls_time', '1',       # 1-second segments (Blueprint)
             '-hls_segment_type', 'fmp4',
-            '-hls_flags', 'independent_segments+append_list',
+            '-hls_flags', 'independent_segments+append_list+temp_file',  # .tmp then rename
             '-hls_fmp4_init_filename', 'init.mp4',
             '-hls_segment_filename', str(self.ebs_dir / 'audio_%03d.m4s'),
             '-hls_list_size', '0',
@@ -77,6 +160,15 @@ class BlueprintAudioPipeline:
                 bufsize=0  # No buffering, immediate write
             )
             
+            # Raw pipe fd: feed_audio writes with os.write, no file-object layer
+            self._stdin_fd = self.ffmpeg_process.stdin.fileno()
+            
+            # Larger pipe: a whole sentence fits without blocking on ffmpeg
+            try:
+                fcntl.fcntl(self._stdin_fd, F_SETPIPE_SZ, PIPE_BUFFER_BYTES)
+            except OSError as e:
+                logger.debug(f"Pipe resize not permitted, using default: {e}")
+            
             self.running = True
             logger.info(f"✅ FFmpeg started: PID {self.ffmpeg_process.pid}")
             
@@ -84,25 +176,75 @@ class BlueprintAudioPipeline:
             logger.error(f"❌ Failed to start ffmpeg: {e}")
             raise
     
-    def feed_audio(self, pcm_data: bytes, sequence: int, is_final: bool = False) -> bool:
+    def _create_segment_watch(self):
+        """Watch the staging dir for completed segments (inotify_simple, Linux)"""
+        if INotify is None:
+            return None
+        
+        try:
+            inotify = INotify()
+            # temp_file: segments appear via rename once complete
+            inotify.add_watch(str(self.ebs_dir), inotify_flags.MOVED_TO | inotify_flags.CLOSE_WRITE)
+            return inotify
+        except OSError as e:
+            logger.warning(f"⚠️ inotify unavailable, scanning for segments: {e}")
+            return None
+    
+    def _watch_segments(self):
+        """Track the newest completed segment until ffmpeg is finalized"""
+        try:
+            while True:
+                stopping = not self.running
+                # After finalize, one non-blocking read drains the last renames
+                timeout = 0 if stopping else SEGMENT_WATCH_TIMEOUT_MS
+                for event in self._inotify.read(timeout=timeout):
+                    self._on_segment_event(event.name)
+                if stopping:
+                    break
+        except Exception as e:
+            logger.error(f"❌ Segment watcher error: {e}")
+        finally:
+            self._inotify.close()
+            self._inotify = None
+    
+    def _on_segment_event(self, name: str):
+        """Record a completed audio_NNN.m4s if it is the newest so far"""
+        match = _SEGMENT_RE.match(name)
+        if not match:
+            return
+        
+        num = int(match.group(1))
+        latest = self._latest_segment
+        # ffmpeg emits segments in order: each newer number is one new segment
+        if latest is None or num > latest[0]:
+            path = self.ebs_dir / name
+            self._latest_segment = (num, path)
+            self._segment_count += 1
+            self._new_segments.append((num, path))
+    
+    def feed_audio(self, pcm_data: Union[bytes, memoryview], sequence: int, is_final: bool = False) -> bool:
         """
         BLUEPRINT: Feed PCM audio to ffmpeg
         Never restart between sentences - continuous pipe
+        Accepts any bytes-like buffer; it is written to the pipe without copying.
         """
         if not self.running or not self.ffmpeg_process:
             logger.error("Pipeline not running")
             return False
         
         try:
+            pcm_view = memoryview(pcm_data).cast('B')
+            
             # BLUEPRINT: Add simple crossfade for first sentence
+            # Only the fade window is copied; the rest goes straight to the pipe
             if sequence == 1:
-                pcm_data = self._add_fade_in(pcm_data)
+                self._write_pcm(self._add_fade_in(pcm_view[:FADE_IN_BYTES]))
+                pcm_view = pcm_view[FADE_IN_BYTES:]
             
             # Write to ffmpeg stdin (continuous pipe)
-            self.ffmpeg_process.stdin.write(pcm_data)
-            self.ffmpeg_process.stdin.flush()
+            self._write_pcm(pcm_view)
             
-            logger.debug(f"📝 Fed {len(pcm_data)} bytes, seq {sequence}")
+            logger.debug("📝 Fed %s bytes, seq %s", len(pcm_data), sequence)
             
             # Handle final audio
             # 🎯 CRITICAL FIX: Handle final audio with delay
@@ -113,23 +255,15 @@ class BlueprintAudioPipeline:
                 logger.info("🚪 Closing stdin to signal EOF to ffmpeg...")
                 self.ffmpeg_process.stdin.close()
                 
-                # Calculate wait time based on audio length
+                # Upper bound for ffmpeg to drain, based on audio length
                 # bytes → samples → seconds: bytes / (2 bytes/sample * 24000 samples/sec)
                 audio_seconds = len(pcm_data) / (2 * 24000.0)
                 wait_time = max(3.0, audio_seconds + 2.0)  # At least 3 seconds
                 
-                logger.info(f"⏳ Waiting {wait_time:.1f}s for {audio_seconds:.1f}s audio to process...")
+                logger.info(f"⏳ Finalizing when ffmpeg exits (up to {wait_time:.1f}s for {audio_seconds:.1f}s audio)...")
                 
-                # Schedule finalization after delay
-                import threading
-                def delayed_finalize():
-                    import time
-                    time.sleep(wait_time)
-                    logger.info(f"✅ Processing complete, now finalizing pipeline")
-                    self._finalize_pipeline()
-                
-                thread = threading.Thread(target=delayed_finalize, daemon=True)
-                thread.start()
+                # Finalize as soon as ffmpeg exits instead of after a fixed sleep
+                _FINALIZE_POOL.submit(self._finalize_pipeline, timeout=wait_time)
             
             return True
             
@@ -141,102 +275,159 @@ class BlueprintAudioPipeline:
             logger.error(f"❌ Failed to feed audio: {e}")
             return False
     
-    def _add_fade_in(self, pcm_data: bytes, fade_ms: int = 10) -> bytes:
+    def _write_pcm(self, data: Union[bytes, memoryview]):
+        """Write all of data to ffmpeg's stdin fd, looping on short writes"""
+        # Closed stdin means the fd number may already be reused elsewhere
+        if self.ffmpeg_process.stdin.closed:
+            raise BrokenPipeError("ffmpeg stdin already closed")
+        
+        view = memoryview(data)
+        while view:
+            written = os.write(self._stdin_fd, view)
+            view = view[written:]
+    
+    def _add_fade_in(self, pcm_data: Union[bytes, memoryview], fade_ms: int = FADE_IN_MS) -> bytes:
         """
         BLUEPRINT: Simple 10ms fade-in for first sentence
-        Minimal processing, no numpy dependency
+        Vectorized over an int16 view of the s16le buffer
         """
         try:
-            # Parse s16le PCM data
-            samples = len(pcm_data) // 2
-            fade_samples = min(samples, int(24000 * fade_ms / 1000))
+            # Parse s16le PCM data (a trailing odd byte is dropped)
+            samples = np.frombuffer(pcm_data, dtype='<i2', count=len(pcm_data) // 2)
+            fade_samples = min(samples.size, int(24000 * fade_ms / 1000))
             
             if fade_samples == 0:
                 return pcm_data
             
-            # Simple linear fade using bytes
-            result = bytearray()
-            for i in range(samples):
-                # Extract 16-bit sample (little endian)
-                if i * 2 + 1 >= len(pcm_data):
-                    break
-                
-                low = pcm_data[i * 2]
-                high = pcm_data[i * 2 + 1]
-                
-                # Convert to signed 16-bit
-                sample = (high << 8) | low
-                if sample >= 32768:
-                    sample -= 65536
-                
-                # Apply fade
-                if i < fade_samples:
-                    fade_factor = i / fade_samples
-                    sample = int(sample * fade_factor)
-                
-                # Convert back to bytes (little endian)
-                result.append(sample & 0xFF)
-                result.append((sample >> 8) & 0xFF)
+            # Short buffers fade over their own length
+            if fade_samples == FADE_IN_SAMPLES:
+                gains = FADE_IN_GAINS
+            else:
+                gains = np.arange(fade_samples) / fade_samples
+            
+            # float64 gains + truncating cast: same result as int(sample * i / n)
+            result = samples.copy()
+            result[:fade_samples] = (result[:fade_samples] * gains).astype(np.int16)
             
-            return bytes(result)
+            return result.tobytes()
             
         except Exception:
             # If fade fails, return original
             logger.warning("Fade-in failed, using original audio")
             return pcm_data
     
-    def _finalize_pipeline(self):
-        """Finalize pipeline and close ffmpeg"""
+    def _finalize_pipeline(self, timeout: float = 5.0):
+        """
+        Finalize pipeline and close ffmpeg (idempotent)
+        Later callers block until the first finalize has finished.
+        """
+        with self._finalize_lock:
+            first = not self._finalized
+            if first:
+                self._finalized = True
+                self._finalize_deadline = time.monotonic() + timeout + FINALIZE_TERMINATE_SECONDS
+        
+        if not first:
+            # ffmpeg may still be flushing its last segment: wait, don't return early
+            remaining = self._finalize_deadline - time.monotonic()
+            if not self._finalize_done.wait(max(remaining, 0.0) + 1.0):
+                logger.warning("Timed out waiting for in-flight finalize")
+            return
+        
         try:
             if not self.running or not self.ffmpeg_process:
                 return
             
-            # Close stdin to signal EOF
-            self.ffmpeg_process.stdin.close()
+            # Close stdin to signal EOF (already closed after the final sentence)
+            if not self.ffmpeg_process.stdin.closed:
+                self.ffmpeg_process.stdin.close()
             
-            # Wait for ffmpeg to finish
+            # Wait for ffmpeg to finish; returns as soon as it exits
             try:
-                self.ffmpeg_process.wait(timeout=5.0)
+                self.ffmpeg_process.wait(timeout=timeout)
             except subprocess.TimeoutExpired:
                 logger.warning("FFmpeg timeout, terminating")
                 self.ffmpeg_process.terminate()
                 try:
-                    self.ffmpeg_process.wait(timeout=2.0)
+                    self.ffmpeg_process.wait(timeout=FINALIZE_TERMINATE_SECONDS)
                 except subprocess.TimeoutExpired:
                     self.ffmpeg_process.kill()
             
-            # Add ENDLIST marker to playlist
+            # Add ENDLIST marker to playlist (ffmpeg writes one itself on clean EOF)
             playlist_path = self.ebs_dir / "playlist.m3u8"
-            if playlist_path.exists():
-                with open(playlist_path, 'a') as f:
-                    f.write('\n#EXT-X-ENDLIST\n')
+            if playlist_path.exists() and '#EXT-X-ENDLIST' not in playlist_path.read_text():
+                # One O_APPEND write: no buffered text wrapper for 16 bytes
+                fd = os.open(playlist_path, os.O_WRONLY | os.O_APPEND)
+                try:
+                    os.write(fd, b'\n#EXT-X-ENDLIST\n')
+                finally:
+                    os.close(fd)
                 logger.debug(f"Added ENDLIST to playlist")
             
+            # Segments ffmpeg flushed while draining, plus the ENDLIST playlist
+            if self.on_finalized is not None:
+                self.on_finalized()
+            
             logger.info(f"✅ Pipeline finalized")
             
         except Exception as e:
             logger.error(f"❌ Finalization error: {e}")
         finally:
             self.running = False
+            self._finalize_done.set()
     
-    def get_latest_segment(self) -> Optional[Path]:
-        """Get latest segment file for S3 upload"""
-        try:
-            segments = list(self.ebs_dir.glob('audio_*.m4s'))
-            if not segments:
-                return None
-            
-            # Find newest segment by timestamp
-            newest = max(segments, key=lambda p: p.stat().st_mtime)
-            
-            # Wait a moment to ensure file is fully written
-            time.sleep(0.1)
-            
-            return newest
-            
-        except Exception as e:
-            logger.error(f"Failed to get latest segment: {e}")
-            return None
+    def take_new_segments(self, rescan: bool = False) -> List[Path]:
+        """
+        Completed segments not returned by a previous call, oldest first
+        A sentence usually spans several 1s segments; each must reach S3 before
+        the playlist that references it. Hand failed uploads back with
+        return_segments(). rescan reads the directory instead of the watcher
+        queue (after ffmpeg exits, the watcher may not have drained yet).
+        """
+        last = self._last_taken_segment
+        found = []
+        
+        if self._watched and not rescan:
+            pending = self._new_segments
+            while pending:
+                num, path = pending.popleft()
+                if num > last:
+                    found.append((num, path))
+        else:
+            try:
+                with os.scandir(self.ebs_dir) as entries:
+                    for entry in entries:
+                        match = _SEGMENT_RE.match(entry.name)
+                        if match:
+                            num = int(match.group(1))
+                            if num > last:
+                                found.append((num, Path(entry.path)))
+                found.sort()
+            except Exception as e:
+                logger.error(f"Failed to list new segments: {e}")
+                return []
+        
+        if not found:
+            return []
+        
+        self._last_taken_segment = found[-1][0]
+        return [path for _, path in found]
+    
+    def return_segments(self, segment_paths: List[Path]):
+        """Hand back segments whose upload failed; the next take returns them again"""
+        numbered = []
+        for path in segment_paths:
+            match = _SEGMENT_RE.match(path.name)
+            if match:
+                numbered.append((int(match.group(1)), path))
+        if not numbered:
+            return
+        
+        numbered.sort()
+        # Rewind the cursor so neither the queue filter nor a rescan skips them
+        self._last_taken_segment = min(self._last_taken_segment, numbered[0][0] - 1)
+        if self._watched:
+            self._new_segments.extendleft(reversed(numbered))
     
     def get_playlist_path(self) -> Optional[Path]:
         """Get playlist file path"""
@@ -249,17 +440,22 @@ class BlueprintAudioPipeline:
         return path if path.exists() else None
     
     def get_segment_count(self) -> int:
-        """Count generated segments"""
-        segments = list(self.ebs_dir.glob('audio_*.m4s'))
-        return len(segments)
+        """Count generated segments (O(1) while the watcher is active)"""
+        if self._watched:
+            return self._segment_count
+        return self._recount()
+    
+    def _recount(self) -> int:
+        """Count segments on disk, e.g. when recovering a staging dir"""
+        with os.scandir(self.ebs_dir) as entries:
+            return sum(1 for e in entries if _SEGMENT_RE.match(e.name))
     
     def get_buffer_seconds(self) -> float:
         """
         Estimate buffer in seconds
         BLUEPRINT: Used for two-phase scheduler (maintain ~3s buffer)
         """
-        segment_count = self.get_segment_count()
-        return segment_count * 1.0  # 1 second per segment
+        return self.get_segment_count() * 1.0  # 1 second per segment
     
     def is_healthy(self) -> bool:
         """Simple health check for monitoring"""
@@ -277,8 +473,8 @@ class BlueprintAudioPipeline:
             return
         
         try:
-            # Finalize if still running
-            if self.is_healthy():
+            # Finalize if still running, or wait for a finalize already under way
+            if self._finalized or self.is_healthy():
                 self._finalize_pipeline()
         except Exception as e:
             logger.error(f"Shutdown error: {e}")
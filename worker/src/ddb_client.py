@@ -5,13 +5,48 @@ Simple DynamoDB operations for voice cloning blueprint
 """
 
 import logging
+import threading
 import boto3
 import time
+from collections import OrderedDict
 from typing import Optional, Tuple, Dict, Any
+from boto3.dynamodb.types import Binary
+from botocore.config import Config
 from botocore.exceptions import ClientError
 
+from src.utils.embedding_codec import encode_embedding, decode_embedding
+
 logger = logging.getLogger('ddb-client')
 
+# Story progress is coalesced per story and written at most once per interval
+PROGRESS_FLUSH_INTERVAL = 1.0
+
+# Decoded voice embeddings kept in-process (LRU, entries expire after TTL)
+VOICE_CACHE_SIZE = 64
+VOICE_CACHE_TTL = 300.0
+
+# Progress writes fail fast (next flush retries); bulk voice reads (pre-warm
+# scan, BatchGetItem of up to 100 voices) get room for large responses
+WRITE_READ_TIMEOUT = 2.0
+BULK_READ_TIMEOUT = 10.0
+
+# BLUEPRINT: Story TTL (story_retention_days = 30)
+STORY_TTL_SECONDS = 30 * 24 * 3600
+
+# Precompiled progress updates for the low-level client (ttl/status/region are reserved words)
+_PROGRESS_UPDATE_EXPR = (
+    'SET last_seq_written = :seq, #s = :status, #t = :ttl_val, '
+    'progress_pct = :progress, updated_at = :updated'
+)
+_PROGRESS_UPDATE_EXPR_REGION = _PROGRESS_UPDATE_EXPR + ', #r = :region'
+_PROGRESS_ATTR_NAMES = {'#s': 'status', '#t': 'ttl'}
+_PROGRESS_ATTR_NAMES_REGION = {'#s': 'status', '#t': 'ttl', '#r': 'region'}
+
+# Completion update, with and without the final audio URL
+_COMPLETE_UPDATE_EXPR = 'SET #s = :status, completed_at = :now, progress_pct = :progress'
+_COMPLETE_UPDATE_EXPR_URL = _COMPLETE_UPDATE_EXPR + ', final_audio_url = :url'
+_COMPLETE_ATTR_NAMES = {'#s': 'status'}
+
 class BlueprintDynamoDBClient:
     """100% Blueprint: Simple DynamoDB client with SSE-KMS encryption"""
     
@@ -20,10 +55,50 @@ class BlueprintDynamoDBClient:
         Initialize DynamoDB client
         Blueprint: Uses SSE-KMS for encryption at rest
         """
-        self.dynamodb = boto3.resource('dynamodb', region_name=region)
+        # Warm keep-alive pool for progress writes and single-voice reads; the
+        # factory's health check (DescribeTable) opens the first TLS session
+        self.dynamodb = boto3.resource('dynamodb', region_name=region, config=Config(
+            tcp_keepalive=True,
+            max_pool_connections=50,
+            retries={'mode': 'adaptive', 'total_max_attempts': 3},
+            connect_timeout=1.0,
+            read_timeout=WRITE_READ_TIMEOUT
+        ))
+        # Separate pool for the TTS engine's bulk reads: a slow scan or batch get
+        # must not be cut off (or retried) on the write path's tight budget
+        self.bulk_dynamodb = boto3.resource('dynamodb', region_name=region, config=Config(
+            tcp_keepalive=True,
+            max_pool_connections=50,
+            retries={'mode': 'standard', 'total_max_attempts': 5},
+            connect_timeout=2.0,
+            read_timeout=BULK_READ_TIMEOUT
+        ))
         self.voices_table = self.dynamodb.Table(voices_table_name)
         self.stories_table = self.dynamodb.Table(stories_table_name)
         
+        # Low-level client (same connection pool) for voice reads and progress writes:
+        # payloads are built pre-typed, skipping the resource (de)serializer
+        self.client = self.dynamodb.meta.client
+        self.voices_table_name = voices_table_name
+        self.stories_table_name = stories_table_name
+        
+        # voice_id -> (expires_at, embeddings, style)
+        self._voice_cache: "OrderedDict[str, Tuple[float, bytes, bytes]]" = OrderedDict()
+        self._voice_cache_lock = threading.Lock()
+        
+        # Deferred progress: story_id -> (last_seq_written, status, region), last write wins
+        self._pending_progress: Dict[str, Tuple[int, str, Optional[str]]] = {}
+        self._pending_lock = threading.Lock()
+        # Serializes progress flushes with completion so 'streaming' never lands after 'complete'
+        self._write_lock = threading.Lock()
+        self._flush_stop = threading.Event()
+        self._flush_thread = threading.Thread(
+            target=self._flush_progress_loop,
+            name='DDBProgressFlush',
+            daemon=True
+        )
+        self._flush_thread.start()
+        
         logger.info(f"✅ DDB Client initialized:")
         logger.info(f"   • Voices table: {voices_table_name}")
         logger.info(f"   • Stories table: {stories_table_name}")
@@ -36,10 +111,17 @@ class BlueprintDynamoDBClient:
         BLUEPRINT: Get voice embeddings from DynamoDB
         Returns: (embeddings_bytes, style_bytes) or (None, None)
         """
+        cached = self._get_cached_voice(voice_id)
+        if cached:
+            return cached
+        
         try:
-            response = self.voices_table.get_item(
-                Key={'voice_id': voice_id},
-                ProjectionExpression='embeddings, style, consent_metadata'
+            # Low-level read: attributes arrive as {'B': bytes}, no resource deserializer
+            response = self.client.get_item(
+                TableName=self.voices_table_name,
+                Key={'voice_id': {'S': voice_id}},
+                ProjectionExpression='embeddings, #st',
+                ExpressionAttributeNames={'#st': 'style'}  # STYLE is a reserved word
             )
             
             if 'Item' not in response:
@@ -50,13 +132,20 @@ class BlueprintDynamoDBClient:
             
             # BLUEPRINT: embeddings and style are KMS-encrypted binary attributes
             embeddings = self._decode_binary_attribute(item.get('embeddings'))
-            style = self._decode_binary_attribute(item.get('style'))
+            # Don't decode style for a voice that can't be used anyway
+            style = self._decode_binary_attribute(item.get('style')) if embeddings is not None else None
             
             if embeddings is None or style is None:
                 logger.warning(f"Voice {voice_id} missing embeddings/style")
                 return None, None
             
-            logger.debug(f"Retrieved voice: {voice_id}")
+            # Compressed blobs are expanded; legacy raw float32 passes through
+            embeddings = decode_embedding(embeddings)
+            style = decode_embedding(style)
+            
+            self._cache_voice(voice_id, embeddings, style)
+            
+            logger.debug("Retrieved voice: %s", voice_id)
             return embeddings, style
             
         except ClientError as e:
@@ -69,11 +158,37 @@ class BlueprintDynamoDBClient:
             logger.error(f"Unexpected error getting voice {voice_id}: {e}")
             return None, None
     
+    def _get_cached_voice(self, voice_id: str) -> Optional[Tuple[bytes, bytes]]:
+        """Return unexpired cached embeddings and mark them recently used"""
+        with self._voice_cache_lock:
+            entry = self._voice_cache.get(voice_id)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                del self._voice_cache[voice_id]
+                return None
+            self._voice_cache.move_to_end(voice_id)
+            return entry[1], entry[2]
+    
+    def _cache_voice(self, voice_id: str, embeddings: bytes, style: bytes):
+        """Insert decoded embeddings, evicting the least recently used"""
+        with self._voice_cache_lock:
+            self._voice_cache[voice_id] = (time.monotonic() + VOICE_CACHE_TTL, embeddings, style)
+            self._voice_cache.move_to_end(voice_id)
+            if len(self._voice_cache) > VOICE_CACHE_SIZE:
+                self._voice_cache.popitem(last=False)
+    
+    def _invalidate_voice(self, voice_id: str):
+        """Drop a voice from the in-process cache"""
+        with self._voice_cache_lock:
+            self._voice_cache.pop(voice_id, None)
+    
     def store_voice_embeddings(self, voice_id: str, embeddings: bytes, style: bytes, 
                                consent_metadata: Dict = None) -> bool:
         """
         BLUEPRINT: Store voice embeddings with SSE-KMS encryption
         Consent metadata must include: user_id, consent_at, consent_version, ip, ua
+        embeddings/style: float32 bytes or ndarray, stored int8-quantized by default
         """
         try:
             # Validate consent metadata
@@ -87,16 +202,19 @@ class BlueprintDynamoDBClient:
                     logger.error(f"Missing consent field: {field}")
                     return False
             
+            # One clock read: created_at/updated_at are equal for a fresh store
+            now = int(time.time())
             item = {
                 'voice_id': voice_id,
-                'embeddings': embeddings,  # Binary attribute, SSE-KMS encrypted
-                'style': style,            # Binary attribute, SSE-KMS encrypted
+                'embeddings': encode_embedding(embeddings),  # Binary attribute, SSE-KMS encrypted
+                'style': encode_embedding(style),            # Binary attribute, SSE-KMS encrypted
                 'consent_metadata': consent_metadata,
-                'created_at': int(time.time()),
-                'updated_at': int(time.time())
+                'created_at': now,
+                'updated_at': now
             }
             
             self.voices_table.put_item(Item=item)
+            self._invalidate_voice(voice_id)
             logger.info(f"✅ Stored voice embeddings: {voice_id}")
             return True
             
@@ -134,47 +252,77 @@ class BlueprintDynamoDBClient:
                             status: str = "streaming", region: str = None):
         """
         BLUEPRINT: Update story progress with TTL
+        Deferred: queued here and written by the background flusher
+        """
+        with self._pending_lock:
+            pending = self._pending_progress.get(story_id)
+            # Never move last_seq_written backwards if sentences finish out of order
+            if pending and pending[0] > last_seq_written:
+                last_seq_written = pending[0]
+            self._pending_progress[story_id] = (last_seq_written, status, region)
+    
+    def flush_progress(self, story_id: str = None):
+        """Write pending progress now (one story, or all when story_id is None)"""
+        with self._write_lock:
+            with self._pending_lock:
+                if story_id is None:
+                    pending = self._pending_progress
+                    self._pending_progress = {}
+                else:
+                    entry = self._pending_progress.pop(story_id, None)
+                    pending = {story_id: entry} if entry else {}
+            
+            for sid, (seq, status, region) in pending.items():
+                try:
+                    self._write_story_progress(sid, seq, status, region)
+                except Exception:
+                    # Re-queue unless a newer update arrived meanwhile
+                    with self._pending_lock:
+                        self._pending_progress.setdefault(sid, (seq, status, region))
+    
+    def _flush_progress_loop(self):
+        """Background flusher: drain pending progress every interval"""
+        while not self._flush_stop.wait(PROGRESS_FLUSH_INTERVAL):
+            if self._pending_progress:
+                self.flush_progress()
+    
+    def _write_story_progress(self, story_id: str, last_seq_written: int,
+                              status: str, region: Optional[str]):
+        """
+        BLUEPRINT: Write story progress with TTL
         TTL: 30 days (configurable via story_retention_days)
         """
         try:
-            # BLUEPRINT: Set TTL for ephemeral stories
-            story_retention_days = 30  # From blueprint
-            ttl_timestamp = int(time.time()) + (story_retention_days * 24 * 3600)
+            now = int(time.time())
             
             # Calculate progress percentage
             # Assuming ~10 sentences per story for estimation
             progress_pct = min(100, last_seq_written * 10)
             
-            # FIXED: Use ExpressionAttributeNames for reserved keyword 'ttl'
             update_values = {
-                ':seq': last_seq_written,
-                ':status': status,
-                ':ttl_val': ttl_timestamp,  # Changed from :ttl to :ttl_val
-                ':progress': progress_pct,
-                ':updated': int(time.time())
+                ':seq': {'N': str(last_seq_written)},
+                ':status': {'S': status},
+                ':ttl_val': {'N': str(now + STORY_TTL_SECONDS)},
+                ':progress': {'N': str(progress_pct)},
+                ':updated': {'N': str(now)}
             }
             
-            # FIXED: Use #t for ttl reserved keyword
-            update_expr = 'SET last_seq_written = :seq, #s = :status, #t = :ttl_val, '
-            update_expr += 'progress_pct = :progress, updated_at = :updated'
-            
             # Add region if provided (Blueprint: multi-region support)
             if region:
-                update_expr += ', #r = :region'  # ✅ FIXED: Use #r for reserved keyword
-                update_values[':region'] = region
-
-            self.stories_table.update_item(
-                Key={'story_id': story_id},
+                update_values[':region'] = {'S': region}
+                update_expr, attr_names = _PROGRESS_UPDATE_EXPR_REGION, _PROGRESS_ATTR_NAMES_REGION
+            else:
+                update_expr, attr_names = _PROGRESS_UPDATE_EXPR, _PROGRESS_ATTR_NAMES
+            
+            self.client.update_item(
+                TableName=self.stories_table_name,
+                Key={'story_id': {'S': story_id}},
                 UpdateExpression=update_expr,
-                ExpressionAttributeNames={
-                    '#s': 'status',
-                    '#t': 'ttl',  # ttl is a reserved keyword
-                    '#r': 'region'  # ✅ ADD THIS: region is ALSO a reserved keyword!
-                },
+                ExpressionAttributeNames=attr_names,
                 ExpressionAttributeValues=update_values
             )
             
-            logger.debug(f"📝 Updated story {story_id}: seq={last_seq_written}, progress={progress_pct}%")
+            logger.debug("📝 Updated story %s: seq=%s, progress=%s%%", story_id, last_seq_written, progress_pct)
             
         except Exception as e:
             logger.error(f"❌ Failed to update story {story_id}: {e}")
@@ -182,6 +330,20 @@ class BlueprintDynamoDBClient:
     
     def mark_story_complete(self, story_id: str, final_audio_url: str = None):
         """BLUEPRINT: Mark story as completed with optional final audio"""
+        # Land the final last_seq_written first; the write lock holds off the flusher
+        with self._write_lock:
+            with self._pending_lock:
+                pending = self._pending_progress.pop(story_id, None)
+            if pending:
+                try:
+                    self._write_story_progress(story_id, *pending)
+                except Exception:
+                    pass  # Logged above; completion below still records the story
+            
+            self._write_story_complete(story_id, final_audio_url)
+    
+    def _write_story_complete(self, story_id: str, final_audio_url: str = None):
+        """Write the completed status for a story"""
         try:
             update_values = {
                 ':status': 'complete',
@@ -189,16 +351,16 @@ class BlueprintDynamoDBClient:
                 ':progress': 100
             }
             
-            update_expr = 'SET #s = :status, completed_at = :now, progress_pct = :progress'
-            
             if final_audio_url:
-                update_expr += ', final_audio_url = :url'
                 update_values[':url'] = final_audio_url
+                update_expr = _COMPLETE_UPDATE_EXPR_URL
+            else:
+                update_expr = _COMPLETE_UPDATE_EXPR
             
             self.stories_table.update_item(
                 Key={'story_id': story_id},
                 UpdateExpression=update_expr,
-                ExpressionAttributeNames={'#s': 'status'},
+                ExpressionAttributeNames=_COMPLETE_ATTR_NAMES,
                 ExpressionAttributeValues=update_values
             )
             
@@ -206,6 +368,7 @@ class BlueprintDynamoDBClient:
             
         except Exception as e:
             logger.error(f"❌ Failed to mark story complete {story_id}: {e}")
+            raise
     
     # ============ VOICE DELETION (HARD DELETE) ============
     
@@ -214,6 +377,9 @@ class BlueprintDynamoDBClient:
         BLUEPRINT: Hard delete voice embeddings and metadata
         Called by /voices/delete API endpoint
         """
+        # Never serve a deleted voice from cache, even if the delete fails midway
+        self._invalidate_voice(voice_id)
+        
         try:
             # Delete the item
             response = self.voices_table.delete_item(
@@ -238,27 +404,21 @@ class BlueprintDynamoDBClient:
     def _decode_binary_attribute(self, binary_data) -> Optional[bytes]:
         """
         Decode DynamoDB binary attribute
-        boto3.resource returns bytes directly for binary attributes
+        Low-level reads give {'B': bytes}, resource reads Binary; exact-type checks
         """
-        try:
-            if binary_data is None:
-                return None
-            
-            if isinstance(binary_data, bytes):
-                return binary_data
-            
-            if isinstance(binary_data, dict) and 'B' in binary_data:
-                value = binary_data['B']
-                if isinstance(value, bytes):
-                    return value
-                # Shouldn't happen with boto3.resource
-                return None
-            
-            return None
-            
-        except Exception as e:
-            logger.error(f"Binary decode error: {e}")
-            return None
+        data_type = type(binary_data)
+        if data_type is dict:
+            value = binary_data.get('B')
+            return value if type(value) is bytes else None
+        if data_type is Binary:
+            return binary_data.value
+        if data_type is bytes:
+            return binary_data
+        
+        # Rare shapes: bytearray/memoryview
+        if isinstance(binary_data, (bytearray, memoryview)):
+            return bytes(binary_data)
+        return None
     
     def health_check(self) -> bool:
         """Simple health check for ASG/ELB"""
@@ -271,6 +431,12 @@ class BlueprintDynamoDBClient:
             logger.error(f"❌ DDB health check failed: {e}")
             return False
     
+    def shutdown(self):
+        """Stop the progress flusher and write anything still pending"""
+        self._flush_stop.set()
+        self._flush_thread.join(timeout=PROGRESS_FLUSH_INTERVAL * 2)
+        self.flush_progress()
+    
     def get_table_info(self) -> Dict[str, Any]:
         """Get table information for monitoring"""
         try:
@@ -336,6 +502,7 @@ if __name__ == "__main__":
         # Test story operations
         test_story_id = 'test-story-123'
         client.update_story_progress(test_story_id, 1, 'streaming', 'us-east-1')
+        client.flush_progress(test_story_id)
         
         progress = client.get_story_progress(test_story_id)
         print(f"Story progress: {progress}")
@@ -9,22 +9,79 @@ Blueprint Requirements:
 • Resume: check existing segments for Spot interruption
 """
 
+import re
 import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
 from pathlib import Path
-from typing import Set, Optional
+from typing import Dict, List, Set, Optional
 import boto3
+from boto3.s3.transfer import TransferConfig, create_transfer_manager
+from botocore.config import Config
 from botocore.exceptions import ClientError
 
 logger = logging.getLogger('s3-uploader')
 
+# Concurrent PUTs for init + segments (playlist stays sequential)
+UPLOAD_WORKERS = 8
+
+# Segment key basename: audio_001.m4s -> 1
+_SEGMENT_RE = re.compile(r'^audio_(\d+)\.m4s$')
+
+# Final audio: multipart above 8 MB, parts uploaded concurrently
+TRANSFER_CHUNK_SIZE = 8 * 1024 * 1024
+TRANSFER_CONCURRENCY = 8
+
+# DeleteObjects limit per request
+S3_DELETE_BATCH = 1000
+
+# Connections: every upload worker and every multipart part can hold one, plus headroom
+S3_POOL_CONNECTIONS = 2 * (UPLOAD_WORKERS + TRANSFER_CONCURRENCY)
+
+# Stories whose uploaded-object set is kept in memory (LRU)
+REMOTE_KEY_CACHE_STORIES = 256
+
 class BlueprintS3Uploader:
     """100% Blueprint: Synchronous S3 uploads with strict segments→playlist order"""
     
     def __init__(self, bucket_name: str, region: str = "us-east-1"):
         # BLUEPRINT: S3 client with region
-        self.s3 = boto3.client('s3', region_name=region)
+        # Pool covers segment PUTs + final-audio parts (shared with the transfer
+        # manager), keep-alive reuses TLS connections, virtual-hosted bucket URLs
+        self.s3 = boto3.client('s3', region_name=region, config=Config(
+            retries={'max_attempts': 3, 'mode': 'standard'},
+            connect_timeout=5,
+            read_timeout=30,
+            max_pool_connections=S3_POOL_CONNECTIONS,
+            tcp_keepalive=True,
+            s3={'addressing_style': 'virtual'}
+        ))
         self.bucket = bucket_name
         
+        # Small objects: parallel PUTs amortize per-request round trips
+        self._upload_pool = ThreadPoolExecutor(
+            max_workers=UPLOAD_WORKERS,
+            thread_name_prefix='S3Upload'
+        )
+        
+        # One shared config for multipart uploads (final audio)
+        self.transfer_config = TransferConfig(
+            multipart_threshold=TRANSFER_CHUNK_SIZE,
+            multipart_chunksize=TRANSFER_CHUNK_SIZE,
+            max_concurrency=TRANSFER_CONCURRENCY,
+            use_threads=True
+        )
+        # Long-lived manager: executor and I/O queue are reused across uploads
+        self._transfer_manager = create_transfer_manager(self.s3, self.transfer_config)
+        
+        # story_id -> keys (relative to the story prefix) already in S3: listed once per story, then kept
+        # current by our own PUTs, so idempotency checks need no HEAD request
+        self._remote_keys: "OrderedDict[str, Set[str]]" = OrderedDict()
+        self._remote_keys_lock = threading.Lock()
+        # story_id -> in-flight first LIST; concurrent first callers wait on it
+        self._remote_listings: Dict[str, Future] = {}
+        
         # BLUEPRINT: Cache-Control headers
         self.segment_headers = {
             'ContentType': 'video/mp4',
@@ -44,30 +101,26 @@ class BlueprintS3Uploader:
         Returns: True if successful or already exists
         """
         try:
-            if not segment_path.exists():
-                logger.error(f"❌ Segment not found: {segment_path}")
-                return False
-            
             # Extract filename (audio_001.m4s)
             filename = segment_path.name
             s3_key = f"stories/{story_id}/{filename}"
             
             # BLUEPRINT: Idempotency check
-            if self._object_exists(s3_key):
-                logger.debug(f"⏭️ Segment already exists: {s3_key}")
+            if self._is_uploaded(story_id, filename):
+                logger.debug("⏭️ Segment already exists: %s", s3_key)
                 return True
             
             # BLUEPRINT: Upload with immutable headers
-            self.s3.upload_file(
-                Filename=str(segment_path),
-                Bucket=self.bucket,
-                Key=s3_key,
-                ExtraArgs=self.segment_headers
-            )
+            self._put_file(segment_path, s3_key, self.segment_headers)
+            self._mark_uploaded(story_id, filename)
             
-            logger.debug(f"📤 Uploaded segment: {s3_key}")
+            logger.debug("📤 Uploaded segment: %s", s3_key)
             return True
             
+        except FileNotFoundError:
+            # The read inside _put_file is the existence check: no extra stat()
+            logger.error(f"❌ Segment not found: {segment_path}")
+            return False
         except Exception as e:
             logger.error(f"❌ Failed to upload segment {segment_path.name}: {e}")
             return False
@@ -78,26 +131,21 @@ class BlueprintS3Uploader:
         Same headers as regular segments
         """
         try:
-            if not init_path.exists():
-                logger.error(f"❌ Init segment not found: {init_path}")
-                return False
-            
             s3_key = f"stories/{story_id}/init.mp4"
             
             # Idempotency check
-            if self._object_exists(s3_key):
+            if self._is_uploaded(story_id, 'init.mp4'):
                 return True
             
-            self.s3.upload_file(
-                Filename=str(init_path),
-                Bucket=self.bucket,
-                Key=s3_key,
-                ExtraArgs=self.segment_headers
-            )
+            self._put_file(init_path, s3_key, self.segment_headers)
+            self._mark_uploaded(story_id, 'init.mp4')
             
             logger.debug(f"📤 Uploaded init segment: {s3_key}")
             return True
             
+        except FileNotFoundError:
+            logger.error(f"❌ Init segment not found: {init_path}")
+            return False
         except Exception as e:
             logger.error(f"❌ Failed to upload init segment: {e}")
             return False
@@ -108,32 +156,45 @@ class BlueprintS3Uploader:
         Returns: True if successful
         """
         try:
-            if not playlist_path.exists():
-                logger.error(f"❌ Playlist not found: {playlist_path}")
-                return False
-            
             s3_key = f"stories/{story_id}/playlist.m3u8"
             
             # BLUEPRINT: Basic HLS contract check - verify at least one segment exists
-            if not self._any_segments_exist(story_id):
+            if not self._has_uploaded_segments(story_id):
                 logger.warning(f"⚠️ No segments found for {story_id}, skipping playlist")
                 return False
             
             # BLUEPRINT: Upload with short TTL headers
-            self.s3.upload_file(
-                Filename=str(playlist_path),
-                Bucket=self.bucket,
-                Key=s3_key,
-                ExtraArgs=self.playlist_headers
-            )
+            self._put_file(playlist_path, s3_key, self.playlist_headers)
+            self._mark_uploaded(story_id, 'playlist.m3u8')
             
             logger.debug(f"📋 Updated playlist: {s3_key}")
             return True
             
+        except FileNotFoundError:
+            logger.error(f"❌ Playlist not found: {playlist_path}")
+            return False
         except Exception as e:
             logger.error(f"❌ Failed to update playlist: {e}")
             return False
     
+    def upload_segments(self, story_id: str, segment_paths: List[Path],
+                        init_path: Optional[Path] = None) -> bool:
+        """
+        BLUEPRINT: Upload init + segments concurrently
+        Blocks until all finish so the caller can upload the playlist after.
+        Returns: True if every upload succeeded
+        """
+        futures = [
+            self._upload_pool.submit(self.upload_segment, story_id, path)
+            for path in segment_paths
+        ]
+        if init_path:
+            futures.append(self._upload_pool.submit(self.upload_init_segment, story_id, init_path))
+        
+        # upload_* never raise; wait on every future before reporting
+        results = [future.result() for future in futures]
+        return all(results)
+    
     def upload_segment_then_playlist(self, story_id: str, segment_path: Path, playlist_path: Path) -> bool:
         """
         BLUEPRINT: Complete upload sequence for one segment
@@ -176,25 +237,16 @@ class BlueprintS3Uploader:
         For story downloads after streaming
         """
         try:
-            if not final_path.exists():
-                logger.error(f"❌ Final audio not found: {final_path}")
-                return False
-            
-            # Create final directory
-            dir_key = f"stories/{story_id}/final/"
-            try:
-                self.s3.put_object(Bucket=self.bucket, Key=dir_key, Body=b'')
-            except:
-                pass  # May already exist
-            
             # Determine content type
             content_types = {
                 'm4a': 'audio/mp4',
                 'mp3': 'audio/mpeg',
                 'opus': 'audio/ogg',
-                'aac': 'audio/aac'
+                'aac': 'audio/aac',
+                'wav': 'audio/wav'
             }
             
+            # S3 keys are flat: no "final/" marker object needed
             s3_key = f"stories/{story_id}/final/story.{audio_format}"
             
             # Upload with 1-day cache
@@ -203,16 +255,16 @@ class BlueprintS3Uploader:
                 'CacheControl': 'public, max-age=86400'  # 1 day
             }
             
-            self.s3.upload_file(
-                Filename=str(final_path),
-                Bucket=self.bucket,
-                Key=s3_key,
-                ExtraArgs=headers
-            )
+            self._transfer_manager.upload(
+                str(final_path), self.bucket, s3_key, extra_args=headers
+            ).result()
             
             logger.info(f"✅ Uploaded final audio: {s3_key}")
             return True
             
+        except FileNotFoundError:
+            logger.error(f"❌ Final audio not found: {final_path}")
+            return False
         except Exception as e:
             logger.error(f"❌ Failed to upload final audio: {e}")
             return False
@@ -222,32 +274,21 @@ class BlueprintS3Uploader:
         BLUEPRINT: Get uploaded segment numbers
         For resume after Spot interruption
         """
+        # One paginated listing per story, shared with the upload idempotency checks
+        keys = self._story_remote_keys(story_id)
+        if keys is None:
+            return set()
+        
         existing = set()
+        with self._remote_keys_lock:
+            for name in keys:
+                # Extract number from audio_001.m4s
+                match = _SEGMENT_RE.match(name)
+                if match:
+                    existing.add(int(match.group(1)))
         
-        try:
-            # List all segments for this story
-            response = self.s3.list_objects_v2(
-                Bucket=self.bucket,
-                Prefix=f"stories/{story_id}/audio_"
-            )
-            
-            if 'Contents' in response:
-                for obj in response['Contents']:
-                    filename = Path(obj['Key']).name
-                    # Extract number from audio_001.m4s
-                    try:
-                        num_part = filename.split('_')[1].split('.')[0]
-                        segment_num = int(num_part)
-                        existing.add(segment_num)
-                    except (ValueError, IndexError):
-                        continue
-            
-            logger.debug(f"📥 Found {len(existing)} existing segments for {story_id}")
-            return existing
-            
-        except Exception as e:
-            logger.warning(f"⚠️ Failed to list segments: {e}")
-            return set()
+        logger.debug("📥 Found %d existing segments for %s", len(existing), story_id)
+        return existing
     
     def get_last_uploaded_segment(self, story_id: str) -> Optional[int]:
         """
@@ -263,12 +304,10 @@ class BlueprintS3Uploader:
         Playlist should only exist if segments exist
         """
         try:
-            # Check if playlist exists
-            playlist_key = f"stories/{story_id}/playlist.m3u8"
-            playlist_exists = self._object_exists(playlist_key)
-            
-            # Check if any segments exist
-            segments_exist = self._any_segments_exist(story_id)
+            # One paginated LIST answers both questions (no HEAD)
+            keys = self._list_story_objects(story_id)
+            playlist_exists = 'playlist.m3u8' in keys
+            segments_exist = any(_SEGMENT_RE.match(name) for name in keys)
             
             # BLUEPRINT RULE: Playlist without segments = violation
             if playlist_exists and not segments_exist:
@@ -298,22 +337,22 @@ class BlueprintS3Uploader:
         Note: Production uses S3 lifecycle policies (7-30 days)
         """
         try:
-            # List all objects for this story
-            response = self.s3.list_objects_v2(
-                Bucket=self.bucket,
-                Prefix=f"stories/{story_id}/"
-            )
+            # List all objects for this story (every page)
+            prefix = f"stories/{story_id}/"
+            objects = [{'Key': prefix + name} for name in self._list_story_objects(story_id)]
             
-            if 'Contents' not in response:
+            if not objects:
                 logger.debug(f"No objects found for {story_id}")
                 return True
             
-            # Delete all objects
-            objects = [{'Key': obj['Key']} for obj in response['Contents']]
-            self.s3.delete_objects(
-                Bucket=self.bucket,
-                Delete={'Objects': objects}
-            )
+            # Delete all objects, DeleteObjects takes at most 1000 keys per call
+            for i in range(0, len(objects), S3_DELETE_BATCH):
+                self.s3.delete_objects(
+                    Bucket=self.bucket,
+                    Delete={'Objects': objects[i:i + S3_DELETE_BATCH]}
+                )
+            with self._remote_keys_lock:
+                self._remote_keys.pop(story_id, None)
             
             logger.info(f"🧹 Cleaned up {len(objects)} objects for {story_id}")
             return True
@@ -322,6 +361,87 @@ class BlueprintS3Uploader:
             logger.error(f"❌ Failed to cleanup {story_id}: {e}")
             return False
     
+    def _put_file(self, path: Path, s3_key: str, headers: dict):
+        """
+        Single PutObject for small HLS files (segments, init, playlist)
+        Skips upload_file's multipart/transfer-manager machinery.
+        """
+        self.s3.put_object(
+            Bucket=self.bucket,
+            Key=s3_key,
+            Body=path.read_bytes(),
+            **headers
+        )
+    
+    def _story_remote_keys(self, story_id: str) -> Optional[Set[str]]:
+        """Uploaded keys for a story (None if the listing failed)"""
+        with self._remote_keys_lock:
+            keys = self._remote_keys.get(story_id)
+            if keys is not None:
+                self._remote_keys.move_to_end(story_id)
+                return keys
+            
+            # Single-flight: only the first caller lists, the rest wait for its result
+            listing = self._remote_listings.get(story_id)
+            if listing is not None:
+                owner = False
+            else:
+                listing = self._remote_listings[story_id] = Future()
+                owner = True
+        
+        if not owner:
+            return listing.result()
+        
+        # First touch of this story on this worker: one paginated LIST, outside the lock
+        keys = None
+        try:
+            keys = self._list_story_objects(story_id)
+        except Exception as e:
+            logger.warning(f"⚠️ Failed to list {story_id}, falling back to HEAD checks: {e}")
+        finally:
+            with self._remote_keys_lock:
+                del self._remote_listings[story_id]
+                if keys is not None:
+                    self._remote_keys[story_id] = keys
+                    if len(self._remote_keys) > REMOTE_KEY_CACHE_STORIES:
+                        self._remote_keys.popitem(last=False)
+            listing.set_result(keys)
+        
+        return keys
+    
+    def _list_story_objects(self, story_id: str) -> Set[str]:
+        """Keys under stories/{story_id}/, relative to that prefix (all pages)"""
+        prefix = f"stories/{story_id}/"
+        names = set()
+        paginator = self.s3.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix, PaginationConfig={'PageSize': 1000}):
+            for obj in page.get('Contents', []):
+                names.add(obj['Key'][len(prefix):])
+        return names
+    
+    def _is_uploaded(self, story_id: str, name: str) -> bool:
+        """Idempotency check: in-memory set lookup, HEAD only if listing failed"""
+        keys = self._story_remote_keys(story_id)
+        if keys is None:
+            return self._object_exists(f"stories/{story_id}/{name}")
+        with self._remote_keys_lock:
+            return name in keys
+    
+    def _mark_uploaded(self, story_id: str, name: str):
+        """Record a successful PUT in the story's cached set"""
+        with self._remote_keys_lock:
+            keys = self._remote_keys.get(story_id)
+            if keys is not None:
+                keys.add(name)
+    
+    def _has_uploaded_segments(self, story_id: str) -> bool:
+        """At least one audio_NNN.m4s in S3, from the cached set when available"""
+        keys = self._story_remote_keys(story_id)
+        if keys is None:
+            return self._any_segments_exist(story_id)
+        with self._remote_keys_lock:
+            return any(_SEGMENT_RE.match(name) for name in keys)
+    
     def _object_exists(self, s3_key: str) -> bool:
         """Check if S3 object exists"""
         try:
@@ -353,6 +473,11 @@ class BlueprintS3Uploader:
             logger.error(f"❌ S3 health check failed: {e}")
             return False
     
+    def shutdown(self):
+        """Wait for in-flight uploads and stop the upload pool and transfer manager"""
+        self._upload_pool.shutdown(wait=True)
+        self._transfer_manager.shutdown()
+    
     def get_bucket_info(self) -> dict:
         """Get bucket information for monitoring"""
         try:
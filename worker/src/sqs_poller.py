@@ -18,6 +18,12 @@ from typing import Dict, List, Optional, Tuple
 from collections import defaultdict
 from botocore.config import Config
 
+try:
+    # C JSON parser, ~3-5x faster than stdlib on message bodies
+    from orjson import loads as json_loads
+except ImportError:
+    json_loads = json.loads
+
 logger = logging.getLogger('sqs-worker')
 
 class ProductionSQSWorker:
@@ -137,7 +143,7 @@ class ProductionSQSWorker:
     def parse_message(self, message: Dict) -> Optional[Dict]:
         """Parse and validate SQS message against blueprint schema"""
         try:
-            body = json.loads(message['Body'])
+            body = json_loads(message['Body'])
             
             # BLUEPRINT: Required fields
             required = ['story_id', 'seq', 'text', 'voice_id', 'lang', 'params', 'idempotency_key']
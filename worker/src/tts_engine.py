@@ -8,6 +8,8 @@ import time
 import json
 import logging
 import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
 from typing import Dict, Optional, Tuple, Any, List
 from collections import OrderedDict
 from pathlib import Path
@@ -15,10 +17,50 @@ from pathlib import Path
 import torch
 import numpy as np
 import boto3
-import base64
+from boto3.dynamodb.types import Binary
+from botocore.config import Config
+
+try:
+    # SIMD base64 (libbase64 AVX2/NEON kernels); stdlib fallback
+    from pybase64 import b64decode as _b64decode
+except ImportError:
+    from base64 import b64decode as _b64decode
+
+from src.utils.embedding_codec import decode_embedding_array
+from src.utils.backoff import backoff_delay
 
 logger = logging.getLogger('tts-engine')
 
+def _decode_attr_dict(value: Dict) -> Optional[bytes]:
+    # Low-level {'B': ...} shape: bytes, or base64 after a JSON round trip
+    inner = value.get('B')
+    if type(inner) is bytes:
+        return inner
+    if type(inner) is str:
+        return _b64decode(inner)
+    return None
+
+# Exact-type dispatch for _decode_ddb_binary; resource reads return Binary
+_DDB_BINARY_DECODERS = {
+    Binary: lambda value: value.value if type(value.value) is bytes else None,
+    bytes: lambda value: value,
+    dict: _decode_attr_dict,
+    str: _b64decode,  # Invalid base64 raises; caught in _decode_ddb_binary
+}
+
+# DynamoDB BatchGetItem accepts at most 100 keys per request
+DDB_BATCH_GET_LIMIT = 100
+DDB_BATCH_MAX_RETRIES = 5  # UnprocessedKeys re-drives before giving up on a chunk
+# Concurrent BatchGetItem chunks (well under the bulk DDB pool's 50 connections)
+DDB_BATCH_WORKERS = 8
+
+# Voice reads fetch only what synthesis needs (STYLE is a DynamoDB reserved word)
+VOICE_PROJECTION = 'embeddings, #st'
+VOICE_PROJECTION_NAMES = {'#st': 'style'}
+
+# Items examined by the pre-warm scan; the newest preload_count of them are loaded
+PRE_WARM_SCAN_LIMIT = 100
+
 class ProductionTTSEngine:
     """Fixed TTS Engine - Model loading bug fixed"""
     
@@ -50,8 +92,15 @@ class ProductionTTSEngine:
         self.model = None
         self.model_loaded = False
         
+        # torch.compile / BF16 autocast (CUDA only, opt-in, see _compile_model)
+        self.compile_enabled = os.getenv('TTS_TORCH_COMPILE', '0') == '1'
+        self.autocast_dtype = None
+        self._eager_gpt = None
+        
         self.dynamodb = None
         self.voices_table_name = None
+        # Multi-chunk batch gets run concurrently: ~1 RTT instead of one per 100 keys
+        self._batch_pool = ThreadPoolExecutor(max_workers=DDB_BATCH_WORKERS, thread_name_prefix='DDBBatchGet')
         
         # CRITICAL: Track frequently used voices for pre-warming
         self.frequent_voice_ids: List[str] = []
@@ -73,12 +122,18 @@ class ProductionTTSEngine:
                 logger.error("❌ Model loading failed")
                 return False
             
+            self._compile_model()
+            
             # BLUEPRINT: Store dependencies
             if dynamodb_client:
                 self.dynamodb = dynamodb_client
             else:
+                # Same settings as the worker's bulk DDB pool: kept-alive, sized for batch gets
                 self.dynamodb = boto3.resource('dynamodb', 
-                    region_name=os.environ.get('AWS_REGION', 'us-east-1'))
+                    region_name=os.environ.get('AWS_REGION', 'us-east-1'),
+                    config=Config(tcp_keepalive=True, max_pool_connections=50,
+                                  retries={'mode': 'standard', 'total_max_attempts': 5},
+                                  connect_timeout=2.0, read_timeout=10.0))
             
             self.voices_table_name = voices_table_name or os.getenv('VOICES_TABLE_NAME')
             
@@ -100,6 +155,10 @@ class ProductionTTSEngine:
             self._pre_warm_specific_voices()
             
             self.model_loaded = True
+            
+            # JIT the compiled graph now rather than on the first story's TTFA path
+            self._warmup_model()
+            
             logger.info("✅ TTS Engine initialized successfully")
             return True
             
@@ -191,6 +250,82 @@ class ProductionTTSEngine:
             logger.error(traceback.format_exc())
             return False
 
+    def _get_inference_model(self):
+        """Unwrap the TTS API object to the XTTS model exposing inference()"""
+        if hasattr(self.model, 'synthesizer') and hasattr(self.model.synthesizer, 'tts_model'):
+            return self.model.synthesizer.tts_model
+        elif hasattr(self.model, 'model'):
+            return self.model.model
+        elif hasattr(self.model, 'tts_model'):
+            return self.model.tts_model
+        return self.model
+
+    def _compile_model(self):
+        """
+        Opt-in: compile the XTTS GPT module and enable BF16 autocast
+        Only gpt(...) forward calls go through the compiled module (generate()
+        stays eager); their shapes vary per sentence, so expect recompiles.
+        """
+        if not (self.device.startswith('cuda') and torch.cuda.is_available()):
+            return
+        
+        if os.getenv('TTS_BF16', '0') == '1' and torch.cuda.is_bf16_supported():
+            self.autocast_dtype = torch.bfloat16
+            logger.info("🔧 BF16 autocast enabled for inference")
+        
+        if not self.compile_enabled or not hasattr(torch, 'compile'):
+            return
+        
+        try:
+            model = self._get_inference_model()
+            gpt = getattr(model, 'gpt', None)
+            if gpt is None:
+                logger.warning("⚠️ Model has no GPT module, skipping torch.compile")
+                return
+            
+            model.gpt = torch.compile(gpt, mode='reduce-overhead', fullgraph=False)
+            self._eager_gpt = gpt
+            logger.info("🔧 GPT decoder compiled (mode=reduce-overhead)")
+        except Exception as e:
+            logger.warning(f"⚠️ torch.compile failed, using eager model: {e}")
+
+    def _warmup_model(self):
+        """Run one synthesis so the compiled graph is built before serving"""
+        if self._eager_gpt is None:
+            return
+        
+        with self.cache_lock:
+            voice_id = next(reversed(self.voice_cache), None)
+        
+        if voice_id is None:
+            logger.info("ℹ️ No cached voice to warm up with, graph will compile on first sentence")
+            return
+        
+        # Warmup must not show up in the serving metrics (p95, counts)
+        with self.metrics_lock:
+            saved_metrics = dict(self.metrics)
+            saved_times = list(self.synthesis_times)
+        
+        try:
+            warmup_start = time.time()
+            self.synthesize("Warming up the voice model.", voice_id)
+            logger.info(f"🔥 Compiled model warmed up in {time.time() - warmup_start:.1f}s")
+        except Exception as e:
+            # Fall back to the eager module rather than failing every sentence
+            logger.warning(f"⚠️ Compiled warmup failed, reverting to eager model: {e}")
+            self._get_inference_model().gpt = self._eager_gpt
+            self._eager_gpt = None
+        finally:
+            with self.metrics_lock:
+                self.metrics.update(saved_metrics)
+                self.synthesis_times[:] = saved_times
+
+    def _autocast(self):
+        """Autocast context for inference (no-op unless BF16 is enabled)"""
+        if self.autocast_dtype is None:
+            return nullcontext()
+        return torch.autocast('cuda', dtype=self.autocast_dtype)
+
     def _move_all_components_to_gpu(self):
         """🚀 Move ALL model components to GPU - UPDATED"""
         try:
@@ -229,25 +364,30 @@ class ProductionTTSEngine:
             logger.warning(f"⚠️ Could not move model to GPU: {e}")
 
     def _pre_warm_cache(self, preload_count: int = 10):
-        """Pre-warm cache with recent voices"""
+        """
+        Pre-warm cache with recent voices
+        Ranks a keys-only scan by created_at; only the newest are fetched and decoded.
+        """
         try:
             if not self.voices_table_name or not self.dynamodb:
                 return
             
             table = self.dynamodb.Table(self.voices_table_name)
             
-            seven_days_ago = int((time.time() - (7 * 24 * 3600)) * 1000)
+            # created_at is epoch seconds (API and DDB client both write int(time.time()))
+            seven_days_ago = int(time.time() - (7 * 24 * 3600))
             
-            response = table.scan(
-                FilterExpression=boto3.dynamodb.conditions.Attr('created_at').gte(seven_days_ago) &
-                                boto3.dynamodb.conditions.Attr('embeddings').exists() &
-                                boto3.dynamodb.conditions.Attr('style').exists(),
-                Limit=preload_count
-            )
+            voice_ids = self._scan_recent_voice_ids(table, seven_days_ago, preload_count)
+            
+            # BatchGetItem returns items unordered; re-rank by voice_id
+            items = {item.get('voice_id'): item for item in self._batch_get_voices(voice_ids)}
             
             loaded = 0
-            for item in response.get('Items', []):
-                if self._cache_voice_item(item):
+            cache_voice_item = self._cache_voice_item
+            # Oldest first, so the newest voice ends up most recently used
+            for voice_id in reversed(voice_ids):
+                item = items.get(voice_id)
+                if item and cache_voice_item(item):
                     loaded += 1
             
             logger.info(f"📥 Pre-warmed cache with {loaded} voices")
@@ -255,6 +395,22 @@ class ProductionTTSEngine:
         except Exception as e:
             logger.warning(f"⚠️ Pre-warm failed: {e}")
 
+    def _scan_recent_voice_ids(self, table, since: int, limit: int) -> List[str]:
+        """Newest voice_ids from a keys-only scan page, ranked by created_at"""
+        response = table.scan(
+            FilterExpression=boto3.dynamodb.conditions.Attr('created_at').gte(since) &
+                            boto3.dynamodb.conditions.Attr('embeddings').exists() &
+                            boto3.dynamodb.conditions.Attr('style').exists(),
+            ProjectionExpression='voice_id, created_at',
+            Limit=PRE_WARM_SCAN_LIMIT
+        )
+        
+        candidates = response.get('Items', [])
+        newest = sorted(range(len(candidates)),
+                        key=lambda i: candidates[i].get('created_at', 0),
+                        reverse=True)[:limit]
+        return [candidates[i]['voice_id'] for i in newest]
+
     def _pre_warm_specific_voices(self):
         """CRITICAL FIX: Pre-warm specific voice IDs immediately"""
         if not self.frequent_voice_ids:
@@ -267,39 +423,100 @@ class ProductionTTSEngine:
         logger.info(f"🔥 Pre-warming {len(self.frequent_voice_ids)} specific voices...")
         
         loaded = 0
-        for voice_id in self.frequent_voice_ids:
-            try:
-                success = self._load_and_cache_voice(voice_id)
-                if success:
+        try:
+            for item in self._batch_get_voices(self.frequent_voice_ids):
+                voice_id = item.get('voice_id')
+                if self._cache_voice_item(item):
                     loaded += 1
                     logger.info(f"  ✅ Pre-warmed: {voice_id}")
                 else:
                     logger.warning(f"  ⚠️ Failed to pre-warm: {voice_id}")
-            except Exception as e:
-                logger.warning(f"  ⚠️ Error pre-warming {voice_id}: {e}")
+        except Exception as e:
+            logger.warning(f"  ⚠️ Error pre-warming voices: {e}")
         
         logger.info(f"🔥 Successfully pre-warmed {loaded}/{len(self.frequent_voice_ids)} voices")
     
+    def _batch_get_voices(self, voice_ids: List[str]) -> List[Dict]:
+        """
+        Fetch voice items with BatchGetItem (100 keys per call, DDB limit)
+        Chunks are fetched concurrently; each re-drives its own UnprocessedKeys.
+        """
+        unique_ids = list(dict.fromkeys(voice_ids))
+        batches = [
+            [{'voice_id': vid} for vid in unique_ids[start:start + DDB_BATCH_GET_LIMIT]]
+            for start in range(0, len(unique_ids), DDB_BATCH_GET_LIMIT)
+        ]
+        
+        # A single chunk doesn't need the thread hop
+        if len(batches) <= 1:
+            return self._batch_get_chunk(batches[0]) if batches else []
+        
+        items = []
+        futures = [self._batch_pool.submit(self._batch_get_chunk, keys) for keys in batches]
+        for future in futures:
+            items.extend(future.result())
+        return items
+    
+    def _batch_get_chunk(self, keys: List[Dict]) -> List[Dict]:
+        """BatchGetItem for up to 100 keys, re-driving UnprocessedKeys with exponential backoff"""
+        items = []
+        attempt = 0
+        # Loop-invariant lookups bound once
+        table_name = self.voices_table_name
+        batch_get_item = self.dynamodb.batch_get_item
+        
+        while keys:
+            response = batch_get_item(
+                RequestItems={
+                    table_name: {'Keys': keys, 'ConsistentRead': False}
+                }
+            )
+            items.extend(response.get('Responses', {}).get(table_name, []))
+            
+            keys = response.get('UnprocessedKeys', {}).get(table_name, {}).get('Keys', [])
+            if keys:
+                attempt += 1
+                if attempt > DDB_BATCH_MAX_RETRIES:
+                    logger.warning(f"⚠️ {len(keys)} voices unprocessed after {attempt - 1} retries")
+                    break
+                # Jitter keeps concurrent chunks from retrying in lockstep
+                time.sleep(backoff_delay(attempt))
+        
+        return items
+    
     def _load_and_cache_voice(self, voice_id: str) -> bool:
         """Load a single voice from DynamoDB and cache it"""
         try:
-            table = self.dynamodb.Table(self.voices_table_name)
-            response = table.get_item(Key={'voice_id': voice_id})
+            item = self._get_voice_item(voice_id)
             
-            if 'Item' not in response:
+            if item is None:
                 logger.debug(f"Voice {voice_id} not found in DynamoDB")
                 return False
             
-            return self._cache_voice_item(response['Item'])
+            return self._cache_voice_item(item, voice_id)
             
         except Exception as e:
             logger.debug(f"Failed to load voice {voice_id}: {e}")
             return False
 
-    def _cache_voice_item(self, voice_data: Dict) -> bool:
+    def _get_voice_item(self, voice_id: str) -> Optional[Dict]:
+        """
+        Fetch a voice's embeddings/style with the low-level client
+        Attributes come back as {'B': bytes}: no resource deserializer, no Binary wrappers.
+        """
+        response = self.dynamodb.meta.client.get_item(
+            TableName=self.voices_table_name,
+            Key={'voice_id': {'S': voice_id}},
+            ProjectionExpression=VOICE_PROJECTION,
+            ExpressionAttributeNames=VOICE_PROJECTION_NAMES
+        )
+        return response.get('Item')
+
+    def _cache_voice_item(self, voice_data: Dict, voice_id: str = None) -> bool:
         """Load single voice from DynamoDB item into cache"""
         try:
-            voice_id = voice_data.get('voice_id')
+            # Projected low-level items carry no voice_id; callers pass it
+            voice_id = voice_id or voice_data.get('voice_id')
             if not voice_id:
                 return False
             
@@ -307,10 +524,13 @@ class ProductionTTSEngine:
                 if voice_id in self.voice_cache:
                     return True
             
+            # Style is only decoded once embeddings are known to be usable
             embeddings_bytes = self._decode_ddb_binary(voice_data.get('embeddings'))
-            style_bytes = self._decode_ddb_binary(voice_data.get('style'))
+            if not embeddings_bytes:
+                return False
             
-            if not embeddings_bytes or not style_bytes:
+            style_bytes = self._decode_ddb_binary(voice_data.get('style'))
+            if not style_bytes:
                 return False
             
             embeddings_tensor, style_tensor = self._create_tensors(embeddings_bytes, style_bytes)
@@ -332,9 +552,9 @@ class ProductionTTSEngine:
 
     def _create_tensors(self, embeddings_bytes: bytes, style_bytes: bytes) -> Tuple[torch.Tensor, torch.Tensor]:
         """Create properly shaped tensors for XTTSv2 with writable arrays"""
-        # Convert bytes to numpy arrays and make them writable
-        embeddings_np = np.frombuffer(embeddings_bytes, dtype=np.float32).copy()
-        style_np = np.frombuffer(style_bytes, dtype=np.float32).copy()
+        # Writable float32 arrays; int8 blobs dequantize into their final buffer
+        embeddings_np = decode_embedding_array(embeddings_bytes)
+        style_np = decode_embedding_array(style_bytes)
         
         # Handle embeddings: ensure shape (1, 512, 1) for HiFiGAN decoder
         if embeddings_np.size == 512:
@@ -449,19 +669,12 @@ class ProductionTTSEngine:
                 language = 'en'
             
             # Get actual model
-            if hasattr(self.model, 'synthesizer') and hasattr(self.model.synthesizer, 'tts_model'):
-                actual_model = self.model.synthesizer.tts_model
-            elif hasattr(self.model, 'model'):
-                actual_model = self.model.model
-            elif hasattr(self.model, 'tts_model'):
-                actual_model = self.model.tts_model
-            else:
-                actual_model = self.model
+            actual_model = self._get_inference_model()
             
             # 🚀 FIXED INFERENCE CALL - REMOVE problem parameters
             inference_start = time.time()
             
-            with torch.no_grad():
+            with torch.no_grad(), self._autocast():
                 # Try different parameter combinations
                 try:
                     # Option 1: With text splitting (FASTEST)
@@ -516,13 +729,13 @@ class ProductionTTSEngine:
             audio_tensor = None
             
             if isinstance(result, dict):
-                logger.debug(f"Result dict keys: {list(result.keys())}")
+                logger.debug("Result dict keys: %s", result.keys())
                 
                 # Try common keys
                 for key in ['wav', 'audio', 'output_wav', 'waveform']:
                     if key in result:
                         audio_tensor = result[key]
-                        logger.debug(f"Found audio in key: '{key}'")
+                        logger.debug("Found audio in key: '%s'", key)
                         break
                 
                 # If not found, search for any tensor
@@ -530,19 +743,19 @@ class ProductionTTSEngine:
                     for key, value in result.items():
                         if isinstance(value, torch.Tensor) and value.dim() > 0:
                             audio_tensor = value
-                            logger.debug(f"Found tensor in key: '{key}', shape: {value.shape}")
+                            logger.debug("Found tensor in key: '%s', shape: %s", key, value.shape)
                             break
             
             elif isinstance(result, torch.Tensor):
                 audio_tensor = result
-                logger.debug(f"Result is tensor, shape: {result.shape}")
+                logger.debug("Result is tensor, shape: %s", result.shape)
             
             elif isinstance(result, (list, tuple)):
                 # Try first element that's a tensor
                 for item in result:
                     if isinstance(item, torch.Tensor) and item.dim() > 0:
                         audio_tensor = item
-                        logger.debug(f"Found tensor in list/tuple, shape: {item.shape}")
+                        logger.debug("Found tensor in list/tuple, shape: %s", item.shape)
                         break
             
             if audio_tensor is None:
@@ -550,7 +763,8 @@ class ProductionTTSEngine:
             
             # Convert to numpy
             if isinstance(audio_tensor, torch.Tensor):
-                audio = audio_tensor.detach().cpu().numpy()
+                # float() first: numpy has no bfloat16 under autocast
+                audio = audio_tensor.detach().float().cpu().numpy()
             else:
                 audio = np.array(audio_tensor)
             
@@ -571,7 +785,7 @@ class ProductionTTSEngine:
             # Ensure proper shape (1D mono, 24kHz)
             if len(audio.shape) > 1:
                 audio = audio.squeeze()
-                logger.debug(f"Squeezed audio shape: {audio.shape}")
+                logger.debug("Squeezed audio shape: %s", audio.shape)
             
             if len(audio.shape) != 1:
                 logger.warning(f"Audio still not 1D: {audio.shape}, flattening")
@@ -631,7 +845,7 @@ class ProductionTTSEngine:
                 self.voice_cache.move_to_end(voice_id)
                 with self.metrics_lock:
                     self.metrics['cache_hits'] += 1
-                logger.debug(f"🎯 Cache hit: {voice_id}")
+                logger.debug("🎯 Cache hit: %s", voice_id)
                 return embeddings, style
         
         with self.metrics_lock:
@@ -639,10 +853,9 @@ class ProductionTTSEngine:
         
         if self.dynamodb and self.voices_table_name:
             try:
-                table = self.dynamodb.Table(self.voices_table_name)
-                response = table.get_item(Key={'voice_id': voice_id})
+                item = self._get_voice_item(voice_id)
                 
-                if 'Item' in response and self._cache_voice_item(response['Item']):
+                if item is not None and self._cache_voice_item(item, voice_id):
                     with self.cache_lock:
                         if voice_id in self.voice_cache:
                             return self.voice_cache[voice_id]
@@ -653,56 +866,14 @@ class ProductionTTSEngine:
         return None, None
 
     def _decode_ddb_binary(self, binary_data):
-        """Decode DynamoDB binary attribute"""
-        try:
-            if binary_data is None:
-                return None
-            
-            # With boto3.resource.Table.get_item(), binary attributes are returned as Binary objects
-            # These have a .value attribute containing the bytes
-            
-            # Method 1: Check if it's a boto3 Binary object with .value attribute
-            if hasattr(binary_data, 'value'):
-                value = binary_data.value
-                if isinstance(value, bytes):
-                    return value
-            
-            # Method 2: If it's already bytes
-            if isinstance(binary_data, bytes):
-                return binary_data
-            
-            # Method 3: Some boto3 Binary objects might be callable
-            if callable(binary_data):
-                try:
-                    result = binary_data()
-                    if isinstance(result, bytes):
-                        return result
-                except:
-                    pass
-            
-            # Method 4: Fallback for other formats
-            if isinstance(binary_data, dict) and 'B' in binary_data:
-                # Could be base64 string or bytes
-                value = binary_data['B']
-                if isinstance(value, bytes):
-                    return value
-                elif isinstance(value, str):
-                    import base64
-                    return base64.b64decode(value)
-            
-            # Method 5: If it's a string, assume it's base64
-            if isinstance(binary_data, str):
-                import base64
-                try:
-                    return base64.b64decode(binary_data)
-                except:
-                    return None
-            
+        """Decode DynamoDB binary attribute (one type-keyed lookup per call)"""
+        decode = _DDB_BINARY_DECODERS.get(type(binary_data))
+        if decode is None:
             return None
-            
+        
+        try:
+            return decode(binary_data)
         except Exception as e:
-            import logging
-            logger = logging.getLogger('tts-engine')
             logger.debug(f"Binary decode error: {e}, type: {type(binary_data)}")
             return None
 
@@ -774,6 +945,7 @@ class ProductionTTSEngine:
         for _ in range(self.max_concurrent_synthesis):
             self.semaphore.acquire()
         
+        self._batch_pool.shutdown(wait=False)
         self.clear_cache()
         
         self.model = None
@@ -0,0 +1,14 @@
+#!/usr/bin/env python3
+"""
+🚀 BACKOFF - Capped exponential retry delays with jitter
+Shared by DynamoDB batch re-drives and background completion retries
+"""
+
+import random
+
+def backoff_delay(attempt: int, base: float = 0.05, cap: float = 1.0, jitter: float = 0.05) -> float:
+    """
+    Seconds to wait before retry number attempt (1-based)
+    min(base * 2**attempt, cap) plus up to jitter, so concurrent retries don't move in lockstep
+    """
+    return min(base * (2 ** attempt), cap) + random.random() * jitter
@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+"""
+🚀 BUFFER POOL - Reusable scratch buffers for the synthesis hot path
+Per-sentence PCM conversion borrows slabs instead of allocating fresh arrays
+"""
+
+import threading
+from typing import Dict, List
+
+import numpy as np
+
+class BufferPool:
+    """Per-thread free lists of numpy slabs, keyed by dtype"""
+
+    def __init__(self, min_slab_elements: int = 24000 * 10, max_slabs_per_dtype: int = 4):
+        # Default slab: 10s of 24kHz mono audio, enough for one sentence
+        self.min_slab_elements = min_slab_elements
+        self.max_slabs_per_dtype = max_slabs_per_dtype
+        self._local = threading.local()
+
+    def _free_list(self, dtype: np.dtype) -> List[np.ndarray]:
+        free_lists: Dict[np.dtype, List[np.ndarray]] = getattr(self._local, 'free_lists', None)
+        if free_lists is None:
+            free_lists = self._local.free_lists = {}
+        return free_lists.setdefault(dtype, [])
+
+    def acquire(self, n: int, dtype) -> np.ndarray:
+        """
+        Borrow a 1-D array of n elements
+        Contents are uninitialized; return it with release() when done.
+        """
+        dtype = np.dtype(dtype)
+        free = self._free_list(dtype)
+
+        for i, slab in enumerate(free):
+            if slab.size >= n:
+                del free[i]
+                return slab[:n]
+
+        # Never allocate below the default slab so short sentences share it
+        size = max(n, self.min_slab_elements)
+        return np.empty(size, dtype=dtype)[:n]
+
+    def release(self, buf: np.ndarray):
+        """Return a borrowed array to the calling thread's free list"""
+        slab = buf.base if isinstance(buf.base, np.ndarray) else buf
+        free = self._free_list(slab.dtype)
+
+        if len(free) < self.max_slabs_per_dtype:
+            free.append(slab)
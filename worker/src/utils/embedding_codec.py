@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+🚀 EMBEDDING CODEC - Compact voice embedding blobs in DynamoDB
+Encoded blobs carry a magic prefix; legacy raw float32 blobs pass through
+"""
+
+import math
+import os
+import struct
+import logging
+from typing import Union
+
+import numpy as np
+
+try:
+    # zstd: smaller blobs, fewer 4 KB read units per voice
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger('embedding-codec')
+
+# b'LVE' + format byte; a legacy float32 blob that happens to start with this
+# is only decoded if the payload checks out, else it passes through untouched
+CODEC_MAGIC = b'LVE'
+FORMAT_ZSTD = 1
+FORMAT_INT8 = 2  # '<f' scale + int8 values, symmetric per-blob quantization
+
+# Every zstd frame starts with this
+ZSTD_FRAME_MAGIC = b'\x28\xb5\x2f\xfd'
+
+ZSTD_LEVEL = 9
+
+# Opt-in int8 storage (4x smaller, lossy and permanent for the stored voice);
+# off by default so new voices keep full float32 precision
+QUANTIZE_EMBEDDINGS = os.getenv('VOICE_EMBEDDINGS_INT8', '0') == '1'
+
+def encode_embedding(raw: Union[bytes, memoryview, np.ndarray], quantize: bool = QUANTIZE_EMBEDDINGS) -> bytes:
+    """
+    Encode a float32 embedding for storage
+    int8 when quantize is set, else zstd (unchanged without zstandard or gain)
+    """
+    if quantize:
+        if not isinstance(raw, np.ndarray) and memoryview(raw).nbytes % 4:
+            raise ValueError(f"Cannot quantize embedding: {memoryview(raw).nbytes} bytes "
+                             f"is not a whole number of float32 values")
+        values = np.asarray(raw, dtype=np.float32) if isinstance(raw, np.ndarray) \
+            else np.frombuffer(raw, dtype=np.float32)
+        peak = float(np.abs(values).max()) if values.size else 0.0
+        scale = peak / 127 if peak > 0 else 1.0
+        quantized = np.round(values / scale).astype(np.int8)
+        return CODEC_MAGIC + bytes((FORMAT_INT8,)) + struct.pack('<f', scale) + quantized.tobytes()
+
+    if isinstance(raw, np.ndarray):
+        raw = raw.astype(np.float32, copy=False).tobytes()
+    elif isinstance(raw, memoryview):
+        raw = raw.tobytes()  # put_item needs bytes for a Binary attribute
+
+    if zstandard is None:
+        return raw
+
+    encoded = CODEC_MAGIC + bytes((FORMAT_ZSTD,)) + zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(raw)
+    # High-entropy float mantissas may not shrink; keep whichever is smaller
+    return encoded if len(encoded) < len(raw) else raw
+
+def _dequantize(data: Union[bytes, memoryview]) -> np.ndarray:
+    """int8 payload -> new float32 array (one allocation, no temporaries)"""
+    scale = struct.unpack_from('<f', data, 4)[0]
+    quantized = np.frombuffer(data, dtype=np.int8, offset=8)
+    return np.multiply(quantized, np.float32(scale), dtype=np.float32)
+
+def _is_int8_blob(data: Union[bytes, memoryview]) -> bool:
+    """Tagged int8 blob with a usable scale (encode always writes a finite, positive one)"""
+    if len(data) < 8 or data[:3] != CODEC_MAGIC or data[3] != FORMAT_INT8:
+        return False
+    scale = struct.unpack_from('<f', data, 4)[0]
+    return math.isfinite(scale) and scale > 0
+
+def decode_embedding(data: Union[bytes, memoryview]) -> Union[bytes, memoryview]:
+    """Return raw float32 bytes for an encoded or legacy blob"""
+    if _is_int8_blob(data):
+        return _dequantize(data).tobytes()
+
+    if data[:3] == CODEC_MAGIC and data[3:4] == bytes((FORMAT_ZSTD,)) and data[4:8] == ZSTD_FRAME_MAGIC:
+        if zstandard is None:
+            raise ValueError("zstd-encoded embedding but zstandard is not installed")
+        try:
+            return zstandard.ZstdDecompressor().decompress(data[4:])
+        except zstandard.ZstdError as e:
+            logger.warning(f"⚠️ Embedding blob not valid zstd, treating as raw float32: {e}")
+
+    # Legacy raw float32 (including blobs that only look tagged)
+    return data
+
+def decode_embedding_array(data: Union[bytes, memoryview]) -> np.ndarray:
+    """
+    Decode straight to a writable float32 array
+    Dequantized blobs are used in place; read-only buffers are copied once.
+    """
+    if _is_int8_blob(data):
+        return _dequantize(data)
+
+    values = np.frombuffer(decode_embedding(data), dtype=np.float32)
+    return values if values.flags.writeable else values.copy()
@@ -10,6 +10,14 @@ import time
 import logging
 from http.server import HTTPServer, BaseHTTPRequestHandler
 
+try:
+    from orjson import dumps as json_dumps
+except ImportError:
+    import json
+    
+    def json_dumps(obj) -> bytes:
+        return json.dumps(obj, separators=(',', ':')).encode()
+
 logger = logging.getLogger('health-check')
 
 class HealthCheckHandler(BaseHTTPRequestHandler):
@@ -19,17 +27,15 @@ class HealthCheckHandler(BaseHTTPRequestHandler):
         if self.path == '/health':
             healthy = self.is_worker_healthy()
             
-            if healthy:
-                self.send_response(200)
-                self.send_header('Content-Type', 'application/json')
-                self.end_headers()
-                response = b'{"status": "healthy", "timestamp": "%s"}' % str(time.time()).encode()
-            else:
-                self.send_response(503)
-                self.send_header('Content-Type', 'application/json')
-                self.end_headers()
-                response = b'{"status": "unhealthy", "timestamp": "%s"}' % str(time.time()).encode()
+            response = json_dumps({
+                'status': 'healthy' if healthy else 'unhealthy',
+                'timestamp': str(time.time())
+            })
             
+            self.send_response(200 if healthy else 503)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(response)))
+            self.end_headers()
             self.wfile.write(response)
         else:
             self.send_response(404)
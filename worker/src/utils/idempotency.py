@@ -4,21 +4,34 @@
 Simple hash-based idempotency matching blueprint spec
 """
 
+import re
 import hashlib
 import logging
-from typing import Optional
+from collections import OrderedDict
+from typing import Optional, Set
 
 logger = logging.getLogger('idempotency')
 
+# Segment key basename: audio_001.m4s -> 1
+_SEGMENT_RE = re.compile(r'^audio_(\d+)\.m4s$')
+
 class BlueprintIdempotency:
     """100% Blueprint: Simple hash-based idempotency"""
     
-    def __init__(self, s3_client, bucket_name: str):
+    def __init__(self, s3_client, bucket_name: str,
+                 max_session_hashes: int = 65536, max_cached_stories: int = 1024):
         self.s3 = s3_client
         self.bucket = bucket_name
         
-        # Simple in-memory cache for current session
-        self.processed_hashes = set()
+        # Simple in-memory cache for current session (bounded LRU)
+        self.processed_hashes = OrderedDict()
+        self.max_session_hashes = max_session_hashes
+        
+        # Per-story sentence seqs finished in this session (bounded LRU of stories).
+        # Sentence seqs are never compared with HLS segment numbers: one
+        # sentence spans several audio_NNN.m4s files, numbered from 0.
+        self.processed_seqs: "OrderedDict[str, Set[int]]" = OrderedDict()
+        self.max_cached_stories = max_cached_stories
         
         logger.info(f"✅ Idempotency initialized for bucket: {bucket_name}")
     
@@ -38,38 +51,32 @@ class BlueprintIdempotency:
         # Use first 16 bytes (32 hex chars) for efficiency
         hash_hex = hash_bytes.hex()[:32]
         
-        logger.debug(f"Generated idempotency hash: {hash_hex[:8]}...")
+        logger.debug("Generated idempotency hash: %s...", hash_hex[:8])
         return hash_hex
     
-    def check_segment_exists(self, story_id: str, seq: int) -> bool:
-        """
-        BLUEPRINT: Check if segment already exists in S3
-        Real idempotency: if segment exists, skip processing
-        """
-        try:
-            segment_key = f"stories/{story_id}/audio_{seq:03d}.m4s"
-            
-            # HEAD request to check existence
-            self.s3.head_object(Bucket=self.bucket, Key=segment_key)
-            
-            logger.info(f"✅ Segment already exists: {segment_key}")
-            return True
-            
-        except self.s3.exceptions.ClientError as e:
-            if e.response['Error']['Code'] == '404':
-                return False  # Segment doesn't exist
-            else:
-                # Other S3 error - log but continue
-                logger.warning(f"S3 error checking segment: {e}")
-                return False
-        except Exception as e:
-            logger.warning(f"Error checking segment: {e}")
-            return False
+    def is_seq_processed(self, story_id: str, seq: int) -> bool:
+        """Check if this sentence of the story was finished in current session"""
+        seqs = self.processed_seqs.get(story_id)
+        return seqs is not None and seq in seqs
+    
+    def mark_seq_processed(self, story_id: str, seq: int):
+        """Record a finished sentence (after its audio was fed and uploaded)"""
+        seqs = self.processed_seqs.get(story_id)
+        if seqs is None:
+            seqs = self.processed_seqs[story_id] = set()
+            if len(self.processed_seqs) > self.max_cached_stories:
+                self.processed_seqs.popitem(last=False)
+        else:
+            self.processed_seqs.move_to_end(story_id)
+        seqs.add(seq)
     
     def mark_hash_processed(self, hash_value: str):
         """Mark hash as processed in current session"""
-        self.processed_hashes.add(hash_value)
-        logger.debug(f"Marked hash as processed: {hash_value[:8]}...")
+        self.processed_hashes[hash_value] = True
+        self.processed_hashes.move_to_end(hash_value)
+        if len(self.processed_hashes) > self.max_session_hashes:
+            self.processed_hashes.popitem(last=False)
+        logger.debug("Marked hash as processed: %s...", hash_value[:8])
     
     def is_hash_processed(self, hash_value: str) -> bool:
         """Check if hash was processed in current session"""
@@ -77,56 +84,54 @@ class BlueprintIdempotency:
     
     def get_existing_segments(self, story_id: str):
         """Get list of existing segments for resume capability"""
-        existing_segments = []
+        existing = self._list_segments(story_id)
+        return sorted(existing) if existing is not None else []
+    
+    def _list_segments(self, story_id: str) -> Optional[Set[int]]:
+        """Segment numbers in S3 for a story, all pages (None if listing failed)"""
+        existing_segments = set()
         
         try:
             # List segments for this story
-            response = self.s3.list_objects_v2(
-                Bucket=self.bucket,
-                Prefix=f"stories/{story_id}/audio_"
-            )
-            
-            if 'Contents' in response:
-                for obj in response['Contents']:
-                    key = obj['Key']
-                    # Extract sequence number
-                    filename = key.split('/')[-1]
-                    if filename.startswith('audio_') and filename.endswith('.m4s'):
-                        try:
-                            seq_str = filename[6:-4]  # Remove 'audio_' and '.m4s'
-                            seq = int(seq_str)
-                            existing_segments.append(seq)
-                        except ValueError:
-                            continue
+            paginator = self.s3.get_paginator('list_objects_v2')
+            for page in paginator.paginate(Bucket=self.bucket, Prefix=f"stories/{story_id}/audio_"):
+                for obj in page.get('Contents', []):
+                    # Extract sequence number from audio_001.m4s
+                    match = _SEGMENT_RE.match(obj['Key'].rpartition('/')[2])
+                    if match:
+                        existing_segments.add(int(match.group(1)))
             
             logger.info(f"Found {len(existing_segments)} existing segments for {story_id}")
             return existing_segments
             
         except Exception as e:
             logger.warning(f"Error listing segments: {e}")
-            return []
+            return None
     
     def should_process(self, story_id: str, seq: int, idempotency_hash: str) -> bool:
         """
         Complete idempotency check:
-        1. Check if segment exists in S3
-        2. Check if hash processed in current session
+        1. Check if hash processed in current session (no I/O)
+        2. Check if this story's sentence seq was already finished (no I/O)
+        Redelivery to another worker is covered by the resume point.
         """
-        # First check: S3 segment existence (most important)
-        if self.check_segment_exists(story_id, seq):
-            return False
-        
-        # Second check: In-memory hash tracking
+        # First check: In-memory hash tracking
         if self.is_hash_processed(idempotency_hash):
             logger.info(f"Hash already processed in this session: {idempotency_hash[:8]}...")
             return False
         
+        # Second check: sentence already finished for this story
+        if self.is_seq_processed(story_id, seq):
+            logger.info(f"Sentence already processed in this session: {story_id}:{seq}")
+            return False
+        
         return True
     
     def clear_session(self):
         """Clear in-memory tracking (e.g., on worker restart)"""
         count = len(self.processed_hashes)
         self.processed_hashes.clear()
+        self.processed_seqs.clear()
         logger.info(f"Cleared {count} session hashes")
 
 # ============ FACTORY FUNCTION ============
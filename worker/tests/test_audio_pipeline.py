@@ -0,0 +1,164 @@
+import subprocess
+import sys
+import time
+
+import pytest
+
+from src import audio_pipeline
+from src.audio_pipeline import BlueprintAudioPipeline
+
+# Stand-in for ffmpeg: drains stdin, takes a moment to "flush", writes the playlist
+FAKE_ENCODER = """
+import pathlib, sys, time
+out = pathlib.Path(sys.argv[1])
+sys.stdin.buffer.read()
+time.sleep(float(sys.argv[2]))
+(out / 'playlist.m3u8').write_text('#EXTM3U\\n#EXTINF:1.0,\\naudio_000.m4s\\n')
+"""
+
+FLUSH_SECONDS = 0.5
+
+@pytest.fixture
+def pipeline(tmp_path, monkeypatch):
+    def start_fake_encoder(self):
+        self.ffmpeg_process = subprocess.Popen(
+            [sys.executable, '-c', FAKE_ENCODER, str(self.ebs_dir), str(FLUSH_SECONDS)],
+            stdin=subprocess.PIPE,
+            bufsize=0
+        )
+        self._stdin_fd = self.ffmpeg_process.stdin.fileno()
+        self.running = True
+
+    monkeypatch.setattr(BlueprintAudioPipeline, '_start_ffmpeg', start_fake_encoder)
+    monkeypatch.setattr(BlueprintAudioPipeline, '_create_segment_watch', lambda self: None)
+
+    pipeline = BlueprintAudioPipeline('story-1', tmp_path)
+    yield pipeline
+    if pipeline.ffmpeg_process.poll() is None:
+        pipeline.ffmpeg_process.kill()
+        pipeline.ffmpeg_process.wait()
+
+def _wait_until(predicate, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "condition not reached"
+        time.sleep(0.01)
+
+def test_shutdown_during_finalize_waits_for_encoder(pipeline):
+    pipeline.feed_audio(bytes(4800), sequence=1, is_final=True)
+
+    # The pooled finalize owns the run and is waiting on the encoder
+    _wait_until(lambda: pipeline._finalized)
+    pipeline.shutdown()
+
+    # Encoder exited on its own (not terminated mid-flush), ENDLIST appended once
+    assert pipeline.ffmpeg_process.returncode == 0
+    playlist = (pipeline.ebs_dir / 'playlist.m3u8').read_text()
+    assert playlist.count('#EXT-X-ENDLIST') == 1
+    assert not pipeline.running
+
+def test_concurrent_finalize_runs_once(pipeline):
+    pipeline.ffmpeg_process.stdin.close()
+
+    futures = [audio_pipeline._FINALIZE_POOL.submit(pipeline._finalize_pipeline, timeout=5.0)
+               for _ in range(3)]
+    for future in futures:
+        future.result(timeout=10)
+
+    assert pipeline.ffmpeg_process.returncode == 0
+    playlist = (pipeline.ebs_dir / 'playlist.m3u8').read_text()
+    assert playlist.count('#EXT-X-ENDLIST') == 1
+
+def test_late_caller_waits_for_first_finalize(pipeline):
+    pipeline.ffmpeg_process.stdin.close()
+    audio_pipeline._FINALIZE_POOL.submit(pipeline._finalize_pipeline, timeout=5.0)
+    _wait_until(lambda: pipeline._finalized)
+
+    # Returns only once the first caller is done, not immediately
+    pipeline._finalize_pipeline()
+    assert pipeline._finalize_done.is_set()
+    assert pipeline.ffmpeg_process.poll() == 0
+
+def _write_segments(directory, numbers):
+    for num in numbers:
+        (directory / f'audio_{num:03d}.m4s').write_bytes(b'')
+
+def _names(paths):
+    return [path.name for path in paths]
+
+def test_take_new_segments_scan_advances_cursor(pipeline):
+    _write_segments(pipeline.ebs_dir, [0, 1, 2])
+    (pipeline.ebs_dir / 'init.mp4').write_bytes(b'')
+
+    assert _names(pipeline.take_new_segments()) == ['audio_000.m4s', 'audio_001.m4s', 'audio_002.m4s']
+    assert pipeline.take_new_segments() == []
+
+    _write_segments(pipeline.ebs_dir, [3])
+    assert _names(pipeline.take_new_segments()) == ['audio_003.m4s']
+
+def test_returned_segments_are_taken_again_after_failed_upload(pipeline):
+    _write_segments(pipeline.ebs_dir, [0, 1, 2])
+    taken = pipeline.take_new_segments()
+
+    # Upload failed: cursor rewinds, the same segments come back with any new ones
+    pipeline.return_segments(taken)
+    _write_segments(pipeline.ebs_dir, [3])
+    assert _names(pipeline.take_new_segments()) == ['audio_000.m4s', 'audio_001.m4s',
+                                                    'audio_002.m4s', 'audio_003.m4s']
+
+def test_watched_queue_returns_failed_segments_in_order(pipeline):
+    pipeline._watched = True
+    for num in (0, 1, 2):
+        pipeline._on_segment_event(f'audio_{num:03d}.m4s')
+
+    taken = pipeline.take_new_segments()
+    assert _names(taken) == ['audio_000.m4s', 'audio_001.m4s', 'audio_002.m4s']
+
+    pipeline._on_segment_event('audio_003.m4s')
+    pipeline.return_segments(taken[1:])
+    assert _names(pipeline.take_new_segments()) == ['audio_001.m4s', 'audio_002.m4s', 'audio_003.m4s']
+    assert pipeline.take_new_segments() == []
+
+def test_rescan_picks_up_segments_the_watcher_has_not_reported(pipeline):
+    pipeline._watched = True
+    _write_segments(pipeline.ebs_dir, [0, 1])
+    pipeline._on_segment_event('audio_000.m4s')
+    assert _names(pipeline.take_new_segments()) == ['audio_000.m4s']
+
+    # Tail flushed by ffmpeg at EOF, rename event not read yet
+    _write_segments(pipeline.ebs_dir, [2])
+    assert _names(pipeline.take_new_segments(rescan=True)) == ['audio_001.m4s', 'audio_002.m4s']
+
+    # A late watcher event for an already-taken segment is not handed out twice
+    pipeline._on_segment_event('audio_002.m4s')
+    assert pipeline.take_new_segments() == []
+
+def test_on_finalized_runs_once_after_endlist(pipeline):
+    seen = []
+    pipeline.on_finalized = lambda: seen.append(
+        (pipeline.ebs_dir / 'playlist.m3u8').read_text().count('#EXT-X-ENDLIST'))
+
+    pipeline.feed_audio(bytes(4800), sequence=1, is_final=True)
+    _wait_until(lambda: pipeline._finalized)
+    pipeline.shutdown()
+
+    assert seen == [1]
+
+def test_segment_watch_closed_when_encoder_fails_to_start(tmp_path, monkeypatch):
+    class FakeWatch:
+        closed = False
+
+        def close(self):
+            self.closed = True
+
+    watch = FakeWatch()
+
+    def fail_to_start(self):
+        raise OSError("ffmpeg not found")
+
+    monkeypatch.setattr(BlueprintAudioPipeline, '_create_segment_watch', lambda self: watch)
+    monkeypatch.setattr(BlueprintAudioPipeline, '_start_ffmpeg', fail_to_start)
+
+    with pytest.raises(OSError):
+        BlueprintAudioPipeline('story-1', tmp_path)
+    assert watch.closed
@@ -0,0 +1,13 @@
+from src.utils import backoff
+from src.utils.backoff import backoff_delay
+
+def test_delay_doubles_then_caps(monkeypatch):
+    monkeypatch.setattr(backoff.random, 'random', lambda: 0.0)
+
+    assert [backoff_delay(n, base=0.25, cap=2.0) for n in (1, 2, 3, 4)] == [0.5, 1.0, 2.0, 2.0]
+
+def test_jitter_stays_within_bound():
+    delays = [backoff_delay(1, base=0.25, cap=2.0, jitter=0.25) for _ in range(200)]
+
+    assert all(0.5 <= delay < 0.75 for delay in delays)
+    assert len(set(delays)) > 1
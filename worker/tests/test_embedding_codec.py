@@ -0,0 +1,72 @@
+import struct
+
+import numpy as np
+import pytest
+
+from src.utils import embedding_codec
+from src.utils.embedding_codec import (CODEC_MAGIC, FORMAT_INT8, FORMAT_ZSTD,
+                                       decode_embedding, decode_embedding_array,
+                                       encode_embedding)
+
+def _embedding(size=512, seed=0):
+    return np.random.default_rng(seed).standard_normal(size).astype(np.float32)
+
+def test_raw_round_trip_without_zstandard(monkeypatch):
+    monkeypatch.setattr(embedding_codec, 'zstandard', None)
+    raw = _embedding().tobytes()
+
+    encoded = encode_embedding(raw, quantize=False)
+    assert encoded == raw
+    assert bytes(decode_embedding(encoded)) == raw
+
+def test_zstd_round_trip():
+    pytest.importorskip('zstandard')
+    # Repetitive values compress, so the tagged form is kept
+    raw = np.tile(_embedding(64), 8).tobytes()
+
+    encoded = encode_embedding(raw, quantize=False)
+    assert encoded[:4] == CODEC_MAGIC + bytes((FORMAT_ZSTD,))
+    assert len(encoded) < len(raw)
+    assert decode_embedding(encoded) == raw
+    np.testing.assert_array_equal(decode_embedding_array(encoded), np.frombuffer(raw, dtype=np.float32))
+
+def test_int8_round_trip_within_one_step():
+    values = _embedding()
+
+    encoded = encode_embedding(values, quantize=True)
+    assert encoded[:4] == CODEC_MAGIC + bytes((FORMAT_INT8,))
+    assert len(encoded) == 8 + values.size
+
+    step = struct.unpack_from('<f', encoded, 4)[0]
+    decoded = decode_embedding_array(encoded)
+    assert decoded.dtype == np.float32
+    np.testing.assert_allclose(decoded, values, atol=step / 2 + 1e-6)
+    np.testing.assert_array_equal(np.frombuffer(decode_embedding(encoded), dtype=np.float32), decoded)
+
+def test_legacy_float32_passes_through():
+    raw = _embedding().tobytes()
+
+    assert decode_embedding(raw) == raw
+    assert decode_embedding(memoryview(raw)) == raw
+    decoded = decode_embedding_array(raw)
+    assert decoded.flags.writeable
+    np.testing.assert_array_equal(decoded, _embedding())
+
+@pytest.mark.parametrize('header', [
+    CODEC_MAGIC + bytes((FORMAT_INT8,)) + struct.pack('<f', float('nan')),
+    CODEC_MAGIC + bytes((FORMAT_INT8,)) + struct.pack('<f', -1.0),
+    CODEC_MAGIC + bytes((FORMAT_ZSTD,)) + b'\x00\x00\x80\x3f',
+    CODEC_MAGIC + b'\x07' + b'\x00\x00\x80\x3f',
+])
+def test_legacy_blob_starting_with_magic_passes_through(header):
+    # Legacy float32 whose first two values happen to spell a codec header
+    raw = header + _embedding().tobytes()[8:]
+
+    assert decode_embedding(raw) == raw
+    np.testing.assert_array_equal(decode_embedding_array(raw), np.frombuffer(raw, dtype=np.float32))
+
+def test_legacy_blob_with_zstd_frame_magic_passes_through():
+    pytest.importorskip('zstandard')
+    raw = CODEC_MAGIC + bytes((FORMAT_ZSTD,)) + embedding_codec.ZSTD_FRAME_MAGIC + _embedding().tobytes()[8:]
+
+    assert decode_embedding(raw) == raw
@@ -0,0 +1,41 @@
+from src.utils.idempotency import BlueprintIdempotency
+
+class FakeS3:
+    """Story already has many HLS segments (audio_000..audio_019) in S3"""
+
+    def get_paginator(self, name):
+        return self
+
+    def paginate(self, Bucket, Prefix):
+        return [{'Contents': [{'Key': f'{Prefix}{n:03d}.m4s'} for n in range(20)]}]
+
+def _run_sentence(manager, story_id, seq):
+    key = manager.generate_key(story_id, seq, f"{story_id} sentence {seq}.", 'voice-1')
+    if not manager.should_process(story_id, seq, key):
+        return False
+    manager.mark_hash_processed(key)
+    manager.mark_seq_processed(story_id, seq)
+    return True
+
+def test_sentences_are_not_skipped_because_segments_exist():
+    manager = BlueprintIdempotency(FakeS3(), 'bucket')
+
+    # Each sentence uploads several segments; none of them may mask a later seq
+    processed = [_run_sentence(manager, 'story-1', seq) for seq in range(1, 6)]
+
+    assert processed == [True] * 5
+
+def test_redelivered_sentence_is_skipped():
+    manager = BlueprintIdempotency(FakeS3(), 'bucket')
+    for seq in (1, 2, 3):
+        _run_sentence(manager, 'story-1', seq)
+
+    assert not _run_sentence(manager, 'story-1', 2)
+    assert _run_sentence(manager, 'story-2', 2)
+
+def test_processed_seqs_are_bounded_per_story():
+    manager = BlueprintIdempotency(FakeS3(), 'bucket', max_cached_stories=2)
+    for story_id in ('a', 'b', 'c'):
+        manager.mark_seq_processed(story_id, 1)
+
+    assert list(manager.processed_seqs) == ['b', 'c']
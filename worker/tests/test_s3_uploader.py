@@ -0,0 +1,37 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+pytest.importorskip('boto3')
+
+from src.s3_uploader import BlueprintS3Uploader
+
+class SlowListS3:
+    """LIST that blocks until released and counts how often it was called"""
+
+    def __init__(self):
+        self.release = threading.Event()
+        self.calls = 0
+
+    def get_paginator(self, name):
+        return self
+
+    def paginate(self, Bucket, Prefix, PaginationConfig=None):
+        self.calls += 1
+        self.release.wait(5)
+        return [{'Contents': [{'Key': f'{Prefix}audio_000.m4s'}]}]
+
+def test_first_listing_is_single_flight():
+    uploader = BlueprintS3Uploader('bucket')
+    uploader.s3 = SlowListS3()
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        futures = [pool.submit(uploader._story_remote_keys, 'story-1') for _ in range(4)]
+        uploader.s3.release.set()
+        results = [future.result(timeout=5) for future in futures]
+
+    assert uploader.s3.calls == 1
+    assert all(keys is results[0] for keys in results)
+    assert results[0] == {'audio_000.m4s'}
+    uploader.shutdown()